@@ -0,0 +1,87 @@
+# Encode time and bytes on the wire per event for each JSON backend and compression.
+#
+#   python benchmarks/encoding.py [rounds]
+#
+# The event is a real materialized capture: a 20 frame stack with locals, 40 lines of source per
+# frame (the Flask default) and a 16 KB JSON request body.
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "core", "src"))
+
+from decipher_core import encoding
+from decipher_core.body import decode_body
+from decipher_core.client import DecipherClient
+from decipher_core.deferred import Deferred
+from decipher_core.transport import encode_payload
+
+
+def handler(depth, order):
+    customer = {"id": 42, "email": "someone@example.com", "tags": ["a", "b", "c"]}
+    lines = [{"sku": "sku-%d" % i, "quantity": i, "price": i * 1.5} for i in range(25)]
+    if depth <= 1:
+        raise KeyError("missing price for %s" % order["id"])
+    handler(depth - 1, order)
+
+
+def build_event(client):
+    order = {"id": "order-1", "items": [{"sku": "sku-%d" % i, "note": "x" * 40} for i in range(200)]}
+    body = json.dumps(order).encode("utf-8")
+    try:
+        handler(20, order)
+    except KeyError as e:
+        fields = {
+            "request_url": "http://bench/orders",
+            "request_headers": {"Content-Type": "application/json", "User-Agent": "bench"},
+            "request_body": Deferred(decode_body, body, "application/json", False),
+            "status_code": 500,
+        }
+        return client.materialize_event(client.snapshot(e, fields)), len(body)
+
+
+def measure(func, rounds):
+    func()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - start)
+    return round(statistics.median(samples) / 1e3, 1)
+
+
+def main(rounds):
+    client = DecipherClient("bench", "bench", endpoint="http://127.0.0.1:9/", context_lines=40)
+    event, body_bytes = build_event(client)
+    available = ["json"]
+    if encoding.orjson:
+        available.insert(0, "orjson")
+    if encoding.ujson:
+        available.insert(-1, "ujson")
+    compressions = [None, encoding.GZIP] + ([encoding.ZSTD] if encoding.zstd else [])
+
+    results = {}
+    for name in available:
+        encoder = encoding.get_encoder(name)
+        raw = encoder(event)
+        for compression in compressions:
+            results["%s/%s" % (name, compression or "none")] = {
+                "encode_us": measure(lambda: encode_payload(event, compression is not None, 0,
+                                                            encoder, compression), rounds),
+                "json_bytes": len(raw),
+                "wire_bytes": len(encode_payload(event, compression is not None, 0, encoder,
+                                                 compression)[0]),
+            }
+    client.transport.close()
+    print(json.dumps({
+        "event": {"frames": len(event["error_stack"]), "request_body_bytes": body_bytes},
+        "available": {"orjson": bool(encoding.orjson), "ujson": bool(encoding.ujson),
+                      "zstd": bool(encoding.zstd)},
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,116 @@
+# Per-request overhead of the FastAPI DecipherMonitor middleware on the success path.
+#
+#   python benchmarks/fastapi_middleware.py [requests] [rounds]
+#
+# Requests are driven straight through the ASGI interface, so the numbers only contain
+# the application and middleware cost, no server or network. POST requests carry a small
+# JSON body, "tee" rows opt into keeping a copy of it (tee_request_body=True).
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "fastapi", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "core", "src"))
+
+from fastapi import FastAPI
+
+from decipher_sdk.decipher_sdk import DecipherMonitor
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/ok",
+    "raw_path": b"/ok",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [(b"host", b"bench")],
+    "client": ("127.0.0.1", 1234),
+    "server": ("bench", 80),
+}
+
+
+POST_SCOPE = dict(SCOPE, method="POST", headers=[(b"host", b"bench"),
+                                                (b"content-type", b"application/json"),
+                                                (b"content-length", b"12")])
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def receive_json():
+    return {"type": "http.request", "body": b'{"ok": true}', "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def bare_app(scope, receive, send):
+    if scope["method"] == "POST":
+        await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def fastapi_app():
+    app = FastAPI()
+
+    @app.get("/ok")
+    async def ok():
+        return {"ok": True}
+
+    @app.post("/ok")
+    async def post_ok(payload: dict):
+        return payload
+
+    return app
+
+
+def monitored(app, **options):
+    # Unroutable endpoint: nothing is sent on the success path anyway
+    return DecipherMonitor(app, "bench", "bench", endpoint="http://127.0.0.1:9/", **options)
+
+
+async def time_requests(app, requests, scope, receive):
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def measure(app, requests, rounds, scope=SCOPE, receive=receive):
+    await time_requests(app, requests // 10, scope, receive)  # warm up
+    return statistics.median([await time_requests(app, requests, scope, receive)
+                              for _ in range(rounds)])
+
+
+async def main(requests, rounds):
+    results = {}
+    for name, factory in (("asgi", lambda: bare_app), ("fastapi", fastapi_app)):
+        for method, scope, body in (("get", SCOPE, receive), ("post", POST_SCOPE, receive_json)):
+            plain = await measure(factory(), requests, rounds, scope, body)
+            variants = [("", {})]
+            if method == "post":
+                variants.append(("_tee", {"tee_request_body": True}))
+            for suffix, options in variants:
+                wrapped = await measure(monitored(factory(), **options), requests, rounds,
+                                        scope, body)
+                results["%s_%s%s" % (name, method, suffix)] = {
+                    "unmonitored_us": round(plain, 3),
+                    "monitored_us": round(wrapped, 3),
+                    "overhead_us": round(wrapped - plain, 3),
+                }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(main(requests, rounds))
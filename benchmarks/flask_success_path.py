@@ -0,0 +1,98 @@
+# Per-request cost of the Flask monitor on requests that raise nothing.
+#
+#   python benchmarks/flask_success_path.py [--iterations N] [--output results.json]
+#
+# Flask fires request_started and request_finished on every request whether or not anything
+# listens. This measures what the SDK adds to those sends (the part it controls) and the
+# end-to-end difference on a bare WSGI call. Baseline and monitor run in separate interpreters
+# because the monitor connects to process-wide signals.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def best_of(func, iterations, repeats=5):
+    # Minimum of several runs, in nanoseconds per call; the minimum is the least noisy estimate
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            func()
+        elapsed = (time.perf_counter_ns() - start) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(mode, iterations):
+    sys.path.insert(0, os.path.join(ROOT, "core", "src"))
+    sys.path.insert(0, os.path.join(ROOT, "flask", "src"))
+    from flask import Flask, request_finished, request_started
+    from werkzeug.test import EnvironBuilder
+
+    app = Flask("bench")
+
+    @app.route("/ok")
+    def ok():
+        return "ok"
+
+    if mode == "monitor":
+        import decipher_sdk
+        # Nothing is ever uploaded, the endpoint only has to be syntactically valid
+        decipher_sdk.init("bench", "bench", endpoint="http://127.0.0.1:9/")
+
+    response = app.response_class("ok")
+    environ = EnvironBuilder(path="/ok").get_environ()
+
+    def signals():
+        request_started.send(app, _async_wrapper=app.ensure_sync)
+        request_finished.send(app, _async_wrapper=app.ensure_sync, response=response)
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def wsgi():
+        for _ in app.wsgi_app(dict(environ), start_response):
+            pass
+
+    with app.test_request_context("/ok"):
+        signal_ns = best_of(signals, iterations)
+    request_ns = best_of(wsgi, max(1, iterations // 10))
+    return {"signals_ns": round(signal_ns, 1), "request_ns": round(request_ns, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--output")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run(args.mode, args.iterations)))
+        return
+
+    results = {}
+    for mode in ("baseline", "monitor"):
+        output = subprocess.check_output([sys.executable, __file__, "--mode", mode,
+                                          "--iterations", str(args.iterations)])
+        results[mode] = json.loads(output)
+    results["overhead"] = {
+        "signals_ns": round(results["monitor"]["signals_ns"] - results["baseline"]["signals_ns"], 1),
+        "request_ns": round(results["monitor"]["request_ns"] - results["baseline"]["request_ns"], 1),
+    }
+    results["environment"] = {"python": platform.python_version(), "platform": platform.platform()}
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
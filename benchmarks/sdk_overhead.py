@@ -0,0 +1,299 @@
+# SDK overhead on the success and error paths, as machine-readable JSON.
+#
+#   python benchmarks/sdk_overhead.py [--requests N] [--output results.json]
+#   python benchmarks/sdk_overhead.py --section flask --mode monitor --options '{"dedup_window": 0}'
+#
+# Everything runs offline: uploads go to a local stub ingest server (stub_ingest.py).
+# Flask and FastAPI both ship a package named decipher_sdk and the Flask monitor connects to
+# process-wide signals, so every (section, mode) pair runs in its own interpreter and the
+# parent only merges the results. Compare two runs by diffing the JSON.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "core", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_ingest import StubIngest
+
+PRINTS_PER_REQUEST = 50
+SCENARIOS = ("ok", "print_heavy", "error_storm")
+MODES = {
+    "baseline": None,
+    "monitor": {"capture_print": True},
+    "monitor_no_dedup": {"capture_print": True, "dedup_window": 0},
+}
+STACK_DEPTHS = (1, 10, 50, 200)
+LOCALS_SIZES = (0, 10, 100, 1000)
+
+
+def summarize(samples_ns):
+    samples = sorted(samples_ns)
+    total = sum(samples)
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / (total / 1e9), 1) if total else None,
+        "p50_us": round(samples[len(samples) // 2] / 1e3, 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1e3, 2),
+        "mean_us": round(total / len(samples) / 1e3, 2),
+    }
+
+
+@contextlib.contextmanager
+def quiet_stdout():
+    # Print-heavy handlers write to stdout, keep it out of the JSON
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def run_flask(mode, requests, stub, options):
+    sys.path.insert(0, os.path.join(ROOT, "flask", "src"))
+    from flask import Flask
+    from werkzeug.test import EnvironBuilder
+    import decipher_sdk
+    from decipher_sdk import decipher_sdk as sdk
+
+    app = Flask("bench")
+    app.logger.disabled = True
+
+    @app.route("/ok")
+    def ok():
+        return {"ok": True}
+
+    @app.route("/print_heavy")
+    def print_heavy():
+        for i in range(PRINTS_PER_REQUEST):
+            print("processing item", i)
+        return {"ok": True}
+
+    @app.route("/error_storm")
+    def error_storm():
+        items = list(range(20))
+        raise ValueError("storm %d" % len(items))
+
+    if options is not None:
+        decipher_sdk.init("bench", "bench", endpoint=stub.endpoint, **options)
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def one(path):
+        environ = EnvironBuilder(path=path).get_environ()
+        start = time.perf_counter_ns()
+        for _ in app(environ, start_response):
+            pass
+        return time.perf_counter_ns() - start
+
+    results = {}
+    with quiet_stdout():
+        for scenario in SCENARIOS:
+            path = "/" + scenario
+            for _ in range(requests // 10):
+                one(path)
+            results[scenario] = summarize([one(path) for _ in range(requests)])
+    if sdk._decipher_monitor_instance:
+        sdk._decipher_monitor_instance.restore_print()
+        sdk._decipher_monitor_instance.transport.close()
+    return results
+
+
+def run_fastapi(mode, requests, stub, options):
+    sys.path.insert(0, os.path.join(ROOT, "fastapi", "src"))
+    from fastapi import FastAPI
+    from decipher_sdk import decipher_sdk as sdk
+
+    app = FastAPI()
+
+    @app.get("/ok")
+    async def ok():
+        return {"ok": True}
+
+    @app.get("/print_heavy")
+    async def print_heavy():
+        for i in range(PRINTS_PER_REQUEST):
+            print("processing item", i)
+        return {"ok": True}
+
+    @app.get("/error_storm")
+    async def error_storm():
+        items = list(range(20))
+        raise ValueError("storm %d" % len(items))
+
+    if options is not None:
+        sdk.init(app, "bench", "bench", endpoint=stub.endpoint, **options)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def one(path):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": b"", "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+        }
+        start = time.perf_counter_ns()
+        try:
+            await app(scope, receive, send)
+        except Exception:
+            # Unhandled errors leave the app after the 500 has been sent, like under a server
+            pass
+        return time.perf_counter_ns() - start
+
+    async def main():
+        results = {}
+        with quiet_stdout():
+            for scenario in SCENARIOS:
+                path = "/" + scenario
+                for _ in range(requests // 10):
+                    await one(path)
+                results[scenario] = summarize([await one(path) for _ in range(requests)])
+        if sdk._decipher_monitor_instance:
+            sdk._decipher_monitor_instance.restore_print()
+            await sdk._decipher_monitor_instance.transport.stop()
+        return results
+
+    return asyncio.run(main())
+
+
+def raise_at_depth(depth, locals_size):
+    # Every frame carries a dict, a list and a string of the requested size
+    mapping = {"key_%d" % i: i for i in range(locals_size)}
+    values = list(range(locals_size))
+    text = "x" * locals_size
+    if depth <= 1:
+        raise ValueError("bottom of %d frames" % len(values))
+    raise_at_depth(depth - 1, locals_size)
+
+
+def make_exception(depth, locals_size):
+    # Raised and caught here so the benchmark's own frame is not part of the traceback
+    try:
+        raise_at_depth(depth, locals_size)
+    except ValueError as e:
+        return e
+
+
+def run_stack(mode, requests, stub, options):
+    from decipher_core.client import DecipherClient
+    from decipher_core.transport import encode_payload
+
+    results = {}
+    for context_lines in (5, 40):
+        client = DecipherClient("bench", "bench", endpoint=stub.endpoint,
+                                context_lines=context_lines, **(options or {}))
+        for depth in STACK_DEPTHS:
+            for locals_size in LOCALS_SIZES:
+                exception = make_exception(depth, locals_size)
+                rounds = max(5, requests // depth)
+                client.get_stack_trace_with_code(exception)  # warm the source cache
+                samples = []
+                for _ in range(rounds):
+                    start = time.perf_counter_ns()
+                    stack = client.get_stack_trace_with_code(exception)
+                    samples.append(time.perf_counter_ns() - start)
+                key = "context_%d/depth_%d/locals_%d" % (context_lines, depth, locals_size)
+                results[key] = {
+                    "rounds": rounds,
+                    "p50_us": round(statistics.median(samples) / 1e3, 2),
+                    "frames": len(stack),
+                    "json_bytes": len(encode_payload(stack, compress=False)[0]),
+                    "gzip_bytes": len(encode_payload(stack, compress_min_size=0)[0]),
+                }
+        client.transport.close()
+    return results
+
+
+SECTIONS = {"flask": run_flask, "fastapi": run_fastapi, "stack": run_stack}
+
+
+def run_section(section, mode, requests, extra_options):
+    options = MODES[mode]
+    if options is not None or extra_options:
+        options = dict(options or {}, **extra_options)
+    stub = StubIngest().start()
+    try:
+        results = SECTIONS[section](mode, requests, stub, options)
+    finally:
+        stub.stop()
+    return {"options": options, "results": results, "ingest": stub.stats()}
+
+
+def run_all(requests, extra_options):
+    results = {}
+    plan = [(section, mode) for section in ("flask", "fastapi") for mode in MODES]
+    plan.append(("stack", "baseline"))
+    for section, mode in plan:
+        command = [sys.executable, os.path.abspath(__file__), "--section", section, "--mode", mode,
+                   "--requests", str(requests), "--options", json.dumps(extra_options)]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            results.setdefault(section, {})[mode] = {"error": completed.stderr.strip()[-2000:]}
+            continue
+        results.setdefault(section, {})[mode] = json.loads(completed.stdout)
+    for section in ("flask", "fastapi"):
+        baseline = results[section].get("baseline", {}).get("results")
+        if not baseline:
+            continue
+        for mode, run in results[section].items():
+            if mode == "baseline" or "results" not in run:
+                continue
+            for scenario, summary in run["results"].items():
+                summary["overhead_p50_us"] = round(summary["p50_us"] - baseline[scenario]["p50_us"], 2)
+                summary["overhead_p99_us"] = round(summary["p99_us"] - baseline[scenario]["p99_us"], 2)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--section", choices=sorted(SECTIONS))
+    parser.add_argument("--mode", choices=sorted(MODES), default="monitor")
+    parser.add_argument("--options", default="{}", help="extra monitor kwargs as JSON")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    extra_options = json.loads(args.options)
+
+    if args.section:
+        output = run_section(args.section, args.mode, args.requests, extra_options)
+    else:
+        output = {
+            "meta": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "platform": platform.platform(),
+                "revision": git_revision(),
+                "requests": args.requests,
+                "prints_per_request": PRINTS_PER_REQUEST,
+            },
+            "results": run_all(args.requests, extra_options),
+        }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
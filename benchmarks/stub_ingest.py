@@ -0,0 +1,144 @@
+# Local stand-in for the Decipher ingest endpoint so benchmarks run offline.
+#
+#   python benchmarks/stub_ingest.py [port]
+#
+# Accepts the same payloads the SDK uploads (single events, JSON arrays of batched events,
+# gzip or zstd bodies) and only counts them. Source files uploaded with source_mode="hash" are
+# kept by digest under /api/source/<sha256> (HEAD to look one up, PUT to store, GET to read).
+import gzip
+import hashlib
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+
+class StubIngest:
+    def __init__(self, host="127.0.0.1", port=0, status=200):
+        self.status = status
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.events = 0
+        self.wire_bytes = 0
+        self.json_bytes = 0
+        self.sources = {}
+        self.source_bytes = 0
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return "http://%s:%d/api/exception_upload" % (host, port)
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def read_body(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                content_encoding = self.headers.get("Content-Encoding")
+                if content_encoding == "gzip":
+                    return body, gzip.decompress(body)
+                if content_encoding == "zstd":
+                    return body, zstd.decompress(body)
+                return body, body
+
+            def reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body and self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def source_digest(self):
+                prefix, _, digest = self.path.rpartition("/")
+                return digest if prefix.endswith("/source") else None
+
+            def do_HEAD(self):
+                with stub.lock:
+                    known = self.source_digest() in stub.sources
+                self.reply(200 if known else 404)
+
+            def do_GET(self):
+                with stub.lock:
+                    source = stub.sources.get(self.source_digest())
+                if source is None:
+                    self.reply(404)
+                else:
+                    self.reply(200, source)
+
+            def do_PUT(self):
+                digest = self.source_digest()
+                body, raw = self.read_body()
+                if digest is None or hashlib.sha256(raw).hexdigest() != digest:
+                    self.reply(400)
+                    return
+                with stub.lock:
+                    stub.sources[digest] = raw
+                    stub.source_bytes += len(body)
+                self.reply(201)
+
+            def do_POST(self):
+                body, raw = self.read_body()
+                payload = json.loads(raw) if raw else None
+                with stub.lock:
+                    stub.requests += 1
+                    stub.events += len(payload) if isinstance(payload, list) else 1
+                    stub.wire_bytes += len(body)
+                    stub.json_bytes += len(raw)
+                self.send_response(stub.status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.requests = self.events = self.wire_bytes = self.json_bytes = 0
+            self.source_bytes = 0
+            self.sources.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "events": self.events,
+                "wire_bytes": self.wire_bytes,
+                "json_bytes": self.json_bytes,
+                "sources": len(self.sources),
+                "source_bytes": self.source_bytes,
+            }
+
+
+if __name__ == "__main__":
+    stub = StubIngest(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765).start()
+    print(stub.endpoint, flush=True)
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        print(json.dumps(stub.stats()))
@@ -0,0 +1,25 @@
+from setuptools import setup, find_packages
+
+setup(
+    name='decipher-core',
+    version='0.0.1',
+    package_dir={'': 'src'},
+    packages=find_packages(where='src'),
+    install_requires=[
+        'requests',
+    ],
+    entry_points={
+        'console_scripts': ['decipher-forwarder=decipher_core.aggregator:main'],
+    },
+    extras_require={
+        'async': ['httpx'],
+        'orjson': ['orjson'],
+        'zstd': ['zstandard'],
+    },
+    author='Decipher AI, Inc',
+    author_email='help@getdecipher.com',
+    description='Framework-agnostic capture pipeline shared by the Decipher AI SDKs',
+    long_description=open('README.md').read(),
+    long_description_content_type='text/markdown',
+    python_requires='>=3.7',
+)
@@ -0,0 +1 @@
+from .client import DecipherClient, safe_method
\ No newline at end of file
@@ -0,0 +1,3 @@
+from .aggregator import main
+
+main()
@@ -0,0 +1,314 @@
+# Per-host forwarder for pre-forked worker fleets (gunicorn, uvicorn --workers ...).
+#
+#   python -m decipher_core --socket /run/decipher.sock [--endpoint URL]
+#
+# Workers started with aggregator_socket=... hand their batches to this process over a Unix
+# domain socket instead of uploading themselves. The forwarder deduplicates across workers,
+# batches and uploads through a single connection pool.
+import argparse
+import os
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from . import forksafe
+from .dedup import Deduplicator
+from .encoding import get_encoder, loads
+from .spool import DiskSpool
+from .transport import BatchTransport, HttpSender
+
+# Every frame is a 4 byte big-endian length followed by a JSON event or array of events
+_HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+def read_exactly(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class SocketSender:
+    # Drop-in replacement for HttpSender that writes to the forwarder. When the forwarder is not
+    # reachable, payloads go to `fallback` (usually an HttpSender) so nothing is lost.
+    def __init__(self, socket_path, fallback=None, json_encoder="auto", timeout=1.0,
+                 reconnect_interval=5.0):
+        self.socket_path = socket_path
+        self.fallback = fallback
+        self.encoder = get_encoder(json_encoder)
+        self.timeout = timeout
+        self.reconnect_interval = reconnect_interval
+        self._sock = None
+        self._retry_at = 0.0
+        # The transport worker and the spool replayer can send at the same time
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The parent's connection must not be shared, each worker opens its own
+        self._sock = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def send(self, payload):
+        body = self.encoder(payload)
+        frame = _HEADER.pack(len(body)) + body
+        with self._lock:
+            # One reconnect attempt: the forwarder may have been restarted since the last send
+            for _ in range(2):
+                sock = self._connect()
+                if sock is None:
+                    break
+                try:
+                    sock.sendall(frame)
+                    return True
+                except OSError:
+                    self._disconnect()
+        if self.fallback is not None:
+            return self.fallback.send(payload)
+        return False
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+        if self.fallback is not None:
+            self.fallback.close()
+
+    def _connect(self):
+        if self._sock is not None:
+            return self._sock
+        if time.monotonic() < self._retry_at:
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            self._retry_at = time.monotonic() + self.reconnect_interval
+            return None
+        self._sock = sock
+        return sock
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+
+class Forwarder:
+    def __init__(self, socket_path, endpoint, batch_size=100, flush_interval=2.0,
+                 max_queue_size=10000, dedup_window=60.0, dedup_max_entries=4096, pool_size=4,
+                 connect_timeout=3.05, read_timeout=10.0, compress=True, json_encoder="auto",
+                 compression="gzip", spool_dir=None, spool_max_bytes=50 * 1024 * 1024):
+        self.socket_path = socket_path
+        self.sender = HttpSender(endpoint, pool_size=pool_size, connect_timeout=connect_timeout,
+                                 read_timeout=read_timeout, compress=compress,
+                                 json_encoder=json_encoder, compression=compression)
+        spool = DiskSpool(spool_dir, max_total_bytes=spool_max_bytes) if spool_dir else None
+        self.transport = BatchTransport(self.sender, batch_size=batch_size,
+                                        flush_interval=flush_interval,
+                                        max_queue_size=max_queue_size, spool=spool)
+        self.dedup_window = dedup_window
+        self.dedup_max_entries = dedup_max_entries
+        # (codebase_id, customer_id) -> Deduplicator, several apps may share one host
+        self.deduplicators = {}
+        self._lock = threading.Lock()
+        if dedup_window:
+            self.transport.flush_hooks.append(self.get_aggregate_events)
+        self.received = 0
+        self.suppressed = 0
+        self.server = None
+
+    def handle_payload(self, payload):
+        events = payload if isinstance(payload, list) else [payload]
+        for event in events:
+            if isinstance(event, dict):
+                self.handle_event(event)
+
+    def handle_event(self, event):
+        with self._lock:
+            self.received += 1
+        error_fingerprint = event.get("fingerprint")
+        if self.dedup_window and error_fingerprint and not event.get("event_type"):
+            deduplicator = self.get_deduplicator(event.get("codebase_id"), event.get("customer_id"))
+            exception_type = self.get_exception_type(event)
+            if not deduplicator.should_send(error_fingerprint, exception_type):
+                # Another worker already reported this error in the current window
+                with self._lock:
+                    self.suppressed += 1
+                return
+        self.transport.enqueue(event)
+
+    def get_deduplicator(self, codebase_id, customer_id):
+        key = (codebase_id, customer_id)
+        with self._lock:
+            deduplicator = self.deduplicators.get(key)
+            if deduplicator is None:
+                deduplicator = self.deduplicators[key] = Deduplicator(
+                    window=self.dedup_window, max_entries=self.dedup_max_entries)
+            return deduplicator
+
+    def get_exception_type(self, event):
+        stack = event.get("error_stack") or []
+        return stack[-1].get("exception_type") if stack and isinstance(stack[-1], dict) else None
+
+    def get_aggregate_events(self):
+        with self._lock:
+            deduplicators = list(self.deduplicators.items())
+        events = []
+        now = datetime.utcnow().isoformat() + 'Z'
+        for (codebase_id, customer_id), deduplicator in deduplicators:
+            for aggregate in deduplicator.drain_aggregates():
+                aggregate.update({
+                    "event_type": "aggregate",
+                    "codebase_id": codebase_id,
+                    "customer_id": customer_id,
+                    "timestamp": now,
+                    "first_seen": datetime.utcfromtimestamp(aggregate["first_seen"]).isoformat() + 'Z',
+                    "last_seen": datetime.utcfromtimestamp(aggregate["last_seen"]).isoformat() + 'Z',
+                })
+                events.append(aggregate)
+        return events
+
+    def stats(self):
+        with self._lock:
+            return {
+                "received": self.received,
+                "suppressed": self.suppressed,
+                "dropped": self.transport.dropped,
+            }
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # Left behind by a forwarder that died
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError("a forwarder is already listening on %s" % self.socket_path)
+            finally:
+                probe.close()
+        forwarder = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    header = read_exactly(self.rfile, _HEADER.size)
+                    if header is None:
+                        return
+                    (size,) = _HEADER.unpack(header)
+                    if size > MAX_FRAME_BYTES:
+                        return
+                    body = read_exactly(self.rfile, size)
+                    if body is None:
+                        return
+                    try:
+                        payload = loads(body)
+                    except ValueError:
+                        continue
+                    forwarder.handle_payload(payload)
+
+        server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        server.daemon_threads = True
+        # Only processes of the same user (or group) may hand over events
+        os.chmod(self.socket_path, 0o660)
+        self.server = server
+        return server
+
+    def serve_forever(self):
+        if self.server is None:
+            self.bind()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        # Called from another thread or a signal handler running outside serve_forever
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        self.transport.close()
+
+
+def wait_for_socket(socket_path, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            return True
+        except OSError:
+            time.sleep(0.05)
+        finally:
+            probe.close()
+    return False
+
+
+def spawn_forwarder(socket_path, endpoint=None, spool_dir=None, timeout=5.0, **options):
+    # Starts the forwarder as a separate process, e.g. from gunicorn's on_starting hook, and
+    # waits until it accepts connections. Returns the Popen handle.
+    command = [sys.executable, "-m", "decipher_core", "--socket", socket_path]
+    if endpoint:
+        command += ["--endpoint", endpoint]
+    if spool_dir:
+        command += ["--spool-dir", spool_dir]
+    for key, value in options.items():
+        command += ["--" + key.replace("_", "-"), str(value)]
+    # Import the same decipher_core as the caller, even when it is not installed site-wide
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_root, env.get("PYTHONPATH")]))
+    process = subprocess.Popen(command, env=env, start_new_session=True)
+    wait_for_socket(socket_path, timeout)
+    return process
+
+
+def main(argv=None):
+    from .client import DEFAULT_ENDPOINT
+
+    parser = argparse.ArgumentParser(prog="decipher-forwarder")
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--endpoint", default=DEFAULT_ENDPOINT)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=2.0)
+    parser.add_argument("--max-queue-size", type=int, default=10000)
+    parser.add_argument("--dedup-window", type=float, default=60.0)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--compression", default="gzip")
+    parser.add_argument("--json-encoder", default="auto")
+    parser.add_argument("--spool-dir")
+    args = parser.parse_args(argv)
+
+    forwarder = Forwarder(args.socket, args.endpoint, batch_size=args.batch_size,
+                          flush_interval=args.flush_interval, max_queue_size=args.max_queue_size,
+                          dedup_window=args.dedup_window, pool_size=args.pool_size,
+                          json_encoder=args.json_encoder, compression=args.compression,
+                          spool_dir=args.spool_dir)
+    forwarder.bind()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: forwarder.shutdown())
+    forwarder.serve_forever()
+
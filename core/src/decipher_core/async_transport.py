@@ -0,0 +1,309 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+from . import forksafe
+from .deferred import materialize
+from .encoding import GZIP, get_compression, get_encoder
+from .metrics import SIZE_BUCKETS
+from .transport import BatchTransport, HttpSender, delivery_status, encode_payload, event_counter
+from .spool import SpoolReplayer
+
+# Placed on the queue to wake the sender task up early when stopping
+_WAKE = object()
+
+
+class AsyncTransport:
+    def __init__(self, endpoint: str, pool_size: int = 4, connect_timeout: float = 3.05,
+                 read_timeout: float = 10.0, compress: bool = True, batch_size: int = 20,
+                 flush_interval: float = 2.0, max_queue_size: int = 1000, spool=None,
+                 json_encoder: str = "auto", compression: str = GZIP, metrics=None):
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.json_encoder = json_encoder
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.compress = compress
+        self.encoder = get_encoder(json_encoder)
+        self.compression = get_compression(compression)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.dropped = 0
+        self.metrics = metrics
+        # Optional DiskSpool that failed and overflowing events are written to. Replays happen
+        # on a thread with a blocking sender so they never compete with requests for the loop.
+        self.spool = spool
+        self.replayer = None
+        # Events that found the queue full, spooled from a thread by _spool_overflow
+        self._overflow = []
+        self._overflow_task = None
+        if spool is not None:
+            replay_sender = HttpSender(endpoint, pool_size=1, connect_timeout=connect_timeout,
+                                       read_timeout=read_timeout, compress=compress,
+                                       json_encoder=json_encoder, compression=compression)
+            self.replayer = SpoolReplayer(spool, replay_sender, batch_size=self.batch_size)
+        # Callables returning extra events (e.g. aggregates), polled once per flush interval
+        self.flush_hooks = []
+        self.queue = None
+        self.client = None
+        self._task = None
+        self._loop = None
+        self._stopping = False
+        # Thread-based transport for events captured while no loop is running (scripts,
+        # excepthooks, before startup), created on first use
+        self.fallback = None
+        self._fallback_lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The sender task and its connections belong to the parent's event loop
+        self.queue = None
+        self.client = None
+        self._task = None
+        self._loop = None
+        self._stopping = False
+        self.dropped = 0
+        self._overflow = []
+        self._overflow_task = None
+        self.fallback = None
+        self._fallback_lock = threading.Lock()
+
+    def enqueue(self, event) -> bool:
+        # Never awaits and never does I/O: safe from the loop and from any other thread
+        loop = self._loop
+        if loop is not None and loop.is_running() and not self._on_loop(loop):
+            # Called from another thread or a short-lived loop, hand over to the sender's loop
+            try:
+                loop.call_soon_threadsafe(self._put, event)
+                return True
+            except RuntimeError:
+                # The loop closed in the meantime
+                pass
+        elif self._ensure_started():
+            return self._put(event)
+        return self.get_fallback().enqueue(event)
+
+    def get_fallback(self):
+        if self.fallback is None:
+            with self._fallback_lock:
+                if self.fallback is None:
+                    sender = HttpSender(self.endpoint, pool_size=1,
+                                        connect_timeout=self.connect_timeout,
+                                        read_timeout=self.read_timeout, compress=self.compress,
+                                        json_encoder=self.json_encoder,
+                                        compression=self.compression, metrics=self.metrics)
+                    self.fallback = BatchTransport(sender, batch_size=self.batch_size,
+                                                   flush_interval=self.flush_interval,
+                                                   max_queue_size=self.max_queue_size,
+                                                   spool=self.spool, metrics=self.metrics)
+        return self.fallback
+
+    def _put(self, event) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.spool is not None and len(self._overflow) < self.max_queue_size:
+            # Runs on the loop: park the event, the file lock, write and materializing happen
+            # on a thread
+            self._overflow.append(event)
+            if self._overflow_task is None:
+                self._overflow_task = self._loop.create_task(self._spool_overflow())
+            return True
+        self.dropped += 1
+        return False
+
+    async def _spool_overflow(self):
+        try:
+            while self._overflow:
+                events, self._overflow = self._overflow, []
+                await asyncio.to_thread(self._spool, events)
+        finally:
+            self._overflow_task = None
+
+    def _spool(self, events) -> bool:
+        events = materialize(events)
+        try:
+            self.spool.append(events)
+            if self.metrics is not None:
+                self.metrics.increment("events_spooled", len(events))
+            return True
+        except OSError:
+            self.dropped += len(events)
+            return False
+        except Exception:
+            if len(events) > 1:
+                return all([self._spool([event]) for event in events])
+            self.dropped += 1
+            return False
+
+    def queue_depth(self) -> int:
+        depth = self.queue.qsize() if self.queue is not None else 0
+        if self.fallback is not None:
+            depth += self.fallback.queue_depth()
+        return depth
+
+    def _on_loop(self, loop) -> bool:
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def start(self):
+        self._ensure_started()
+
+    async def stop(self, timeout: float = 5.0):
+        if self.fallback is not None:
+            await asyncio.to_thread(self.fallback.close, timeout)
+        task = self._task
+        if task is None:
+            return
+        self._stopping = True
+        try:
+            self.queue.put_nowait(_WAKE)
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        if self._overflow_task is not None:
+            await asyncio.wait([self._overflow_task], timeout=timeout)
+        await self.client.aclose()
+        if self.replayer is not None:
+            self.replayer.stop()
+        self._task = None
+        self._loop = None
+        self._stopping = False
+
+    def _ensure_started(self) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._loop is loop and not self._task.done():
+            return True
+        if self._stopping:
+            return False
+        pending = []
+        if self.queue is not None:
+            # The previous loop went away (e.g. a test client portal), carry its events over
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is not _WAKE:
+                    pending.append(item)
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        for item in pending:
+            self.queue.put_nowait(item)
+        limits = httpx.Limits(max_connections=self.pool_size,
+                              max_keepalive_connections=self.pool_size)
+        self.client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+        # A task spooling overflow on the previous loop will never finish
+        self._overflow_task = None
+        if self._overflow:
+            self._overflow_task = loop.create_task(self._spool_overflow())
+        if self.replayer is not None:
+            self.replayer.start()
+        return True
+
+    async def _run(self):
+        next_hooks = self._loop.time() + self.flush_interval
+        while True:
+            batch = await self._next_batch()
+            if self._stopping or self._loop.time() >= next_hooks:
+                batch.extend(self._poll_hooks())
+                next_hooks = self._loop.time() + self.flush_interval
+            if batch:
+                await self._send(batch)
+            elif self._stopping and self.queue.empty():
+                return
+
+    def _poll_hooks(self):
+        events = []
+        for hook in self.flush_hooks:
+            try:
+                events.extend(hook())
+            except Exception as e:
+                pass
+        return events
+
+    async def _next_batch(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if self._stopping:
+                if self.queue.empty():
+                    break
+                item = self.queue.get_nowait()
+            else:
+                if deadline is None:
+                    # Wake up at least once per interval so the flush hooks get polled
+                    timeout = self.flush_interval
+                else:
+                    timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _WAKE:
+                continue
+            batch.append(item)
+            if deadline is None:
+                deadline = self._loop.time() + self.flush_interval
+        return batch
+
+    async def _send(self, batch) -> bool:
+        # Snapshots are materialized and encoded on a thread so the loop keeps serving requests
+        try:
+            body, headers = await asyncio.to_thread(self._encode, batch)
+        except Exception:
+            # An event the encoder cannot handle, drop only that one and keep the task running
+            if len(batch) > 1:
+                for event in batch:
+                    await self._send([event])
+            else:
+                self.dropped += 1
+            return False
+        if body is None:
+            return True
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        try:
+            response = await self.client.post(self.endpoint, content=body, headers=headers)
+            delivered = delivery_status(response.status_code)
+        except httpx.HTTPError:
+            delivered = False
+        if metrics is not None:
+            metrics.observe("upload_seconds", time.perf_counter() - start)
+            metrics.increment(event_counter(delivered), len(batch))
+        if not delivered and self.spool is not None:
+            await asyncio.to_thread(self._spool, batch)
+        return delivered
+
+    def _encode(self, batch):
+        # Materializes in place so a failed upload spools the plain events
+        batch[:] = materialize(batch)
+        if not batch:
+            return None, None
+        # Single events keep the original upload format, larger batches go up as a JSON array
+        payload = batch[0] if len(batch) == 1 else batch
+        metrics = self.metrics
+        if metrics is None:
+            return encode_payload(payload, self.compress, encoder=self.encoder,
+                                  compression=self.compression)
+        start = time.perf_counter()
+        body, headers = encode_payload(payload, self.compress, encoder=self.encoder,
+                                       compression=self.compression)
+        metrics.observe("encode_seconds", time.perf_counter() - start)
+        metrics.observe("payload_bytes", len(body), SIZE_BUCKETS)
+        return body, headers
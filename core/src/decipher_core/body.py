@@ -0,0 +1,118 @@
+from .encoding import RawJson
+
+_BINARY_TYPES = {
+    "application/octet-stream",
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "application/x-tar",
+    "application/protobuf",
+    "application/x-protobuf",
+    "application/grpc",
+    "application/msgpack",
+    "application/x-msgpack",
+}
+_BINARY_PREFIXES = ("multipart/", "image/", "audio/", "video/", "font/")
+
+
+def is_capturable(content_type):
+    if not content_type:
+        return True
+    mime = content_type.split(";", 1)[0].strip().lower()
+    return mime not in _BINARY_TYPES and not mime.startswith(_BINARY_PREFIXES)
+
+
+def get_charset(content_type):
+    if content_type:
+        for param in content_type.split(";")[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "charset" and value:
+                return value.strip().strip('"')
+    return "utf-8"
+
+
+def decode_body(data, content_type=None, truncated=False):
+    if data is None:
+        return None
+    try:
+        text = data.decode(get_charset(content_type), "replace")
+    except LookupError:
+        text = data.decode("utf-8", "replace")
+    if truncated:
+        # A cut-off document would never parse, keep the prefix as text
+        return text + "..."
+    stripped = text.lstrip()
+    if stripped[:1] in ("{", "[", '"') or stripped in ("true", "false", "null"):
+        # Kept encoded, the payload encoder embeds it (or falls back to text if it is not JSON)
+        return RawJson(text)
+    return text
+
+
+class BodyTee:
+    # Keeps the first `limit` bytes of whatever flows through it
+    __slots__ = ("limit", "buffer", "truncated")
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.buffer = bytearray()
+        self.truncated = False
+
+    def keep(self, data):
+        if not data:
+            return
+        room = self.limit - len(self.buffer)
+        if room > 0:
+            self.buffer += data[:room]
+        if len(data) > room:
+            self.truncated = True
+
+    def getvalue(self):
+        return bytes(self.buffer)
+
+
+class TeeInput:
+    # Wraps wsgi.input so the request body is captured as the application reads it
+    def __init__(self, stream, tee):
+        self.stream = stream
+        self.tee = tee
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.tee.keep(data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.tee.keep(data)
+        return data
+
+    def readlines(self, *args):
+        lines = self.stream.readlines(*args)
+        for line in lines:
+            self.tee.keep(line)
+        return lines
+
+    def __iter__(self):
+        for line in self.stream:
+            self.tee.keep(line)
+            yield line
+
+    def close(self):
+        close = getattr(self.stream, "close", None)
+        if close is not None:
+            close()
+
+
+class ReceiveTee:
+    # Wraps an ASGI receive channel so the request body is captured as the application reads it
+    __slots__ = ("receive", "tee")
+
+    def __init__(self, receive, tee):
+        self.receive = receive
+        self.tee = tee
+
+    async def __call__(self):
+        message = await self.receive()
+        if message["type"] == "http.request":
+            self.tee.keep(message.get("body"))
+        return message
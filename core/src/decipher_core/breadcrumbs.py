@@ -0,0 +1,97 @@
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+_installed_handler = None
+
+
+class Breadcrumbs:
+    # Fixed-size ring buffer of raw entries. Nothing is formatted until an event is reported.
+    def __init__(self, max_entries=100):
+        self.entries = deque(maxlen=max_entries)
+
+    def add_record(self, record):
+        self.entries.append(record)
+
+    def add_print(self, args):
+        self.entries.append((time.time(), "log", args))
+
+    def add_message(self, message, level="info"):
+        self.entries.append((time.time(), level, (message,)))
+
+    def clear(self):
+        self.entries.clear()
+
+    def __getstate__(self):
+        # Pickled into process pool workers: log records and print args may hold unpicklable
+        # objects, keep only the rendered messages
+        entries = [(created, level, (message,))
+                   for created, level, message in map(_render, list(self.entries))]
+        return self.entries.maxlen, entries
+
+    def __setstate__(self, state):
+        max_entries, entries = state
+        self.entries = deque(entries, maxlen=max_entries)
+
+    def snapshot(self):
+        # Copy of the current entries, so they can be formatted later while the request goes on
+        copy = Breadcrumbs(self.entries.maxlen)
+        copy.entries.extend(list(self.entries))
+        return copy
+
+    def format(self, max_message_length=1024):
+        messages = []
+        for created, level, message in map(_render, list(self.entries)):
+            if len(message) > max_message_length:
+                message = message[:max_message_length] + "..."
+            messages.append({
+                "message": message,
+                "level": level,
+                "timestamp": datetime.utcfromtimestamp(created).isoformat() + 'Z'
+            })
+        return messages
+
+
+def _render(entry):
+    # (created, level, message) of a log record or a (created, level, args) entry
+    if isinstance(entry, logging.LogRecord):
+        try:
+            message = entry.getMessage()
+        except Exception as e:
+            message = str(entry.msg)
+        return entry.created, entry.levelname.lower(), message
+    created, level, args = entry
+    return created, level, ' '.join(str(arg) for arg in args)
+
+
+class BreadcrumbHandler(logging.Handler):
+    def __init__(self, get_breadcrumbs, level=logging.INFO):
+        super().__init__(level)
+        # Returns the current request's Breadcrumbs, or None outside of a request
+        self.get_breadcrumbs = get_breadcrumbs
+
+    def handle(self, record):
+        # deque.append is thread-safe, skip the handler lock that Handler.handle takes
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+
+    def emit(self, record):
+        try:
+            breadcrumbs = self.get_breadcrumbs()
+        except Exception as e:
+            return
+        if breadcrumbs is not None:
+            breadcrumbs.add_record(record)
+
+
+def install_handler(handler):
+    # Only one SDK handler on the root logger, even if init() runs more than once
+    global _installed_handler
+    root = logging.getLogger()
+    if _installed_handler is not None:
+        root.removeHandler(_installed_handler)
+    root.addHandler(handler)
+    _installed_handler = handler
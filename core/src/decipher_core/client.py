@@ -0,0 +1,558 @@
+import builtins
+import functools
+import logging
+import os
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from .aggregator import SocketSender
+from .breadcrumbs import BreadcrumbHandler, install_handler
+from .context import (CapturedContext, ContextCallable, ContextExecutor, current_context,
+                      install_excepthooks, set_client)
+from .dedup import Deduplicator, RecentFingerprints, fingerprint
+from .deferred import Deferred, DeferredEvent, resolve_fields
+from .frames import FrameClassifier
+from .latency import UNMATCHED, LatencyTracker
+from .metrics import (Metrics, StatsdExporter, get_swallowed_errors, record_swallowed_error,
+                      serve_prometheus)
+from .profiler import SamplingProfiler
+from .sampling import Sampler
+from .serializer import SafeSerializer
+from .source_cache import SourceCache
+from .sources import HASH, INLINE, SourceUploader, default_source_endpoint
+from .spool import DiskSpool
+from .transport import BatchTransport, HttpSender
+
+DEFAULT_ENDPOINT = "https://prod.getdecipher.com/api/exception_upload"
+#DEFAULT_ENDPOINT = "http://localhost:3000/api/exception_upload"
+
+# Captured at import so creating several clients never wraps our own print
+_original_print = builtins.print
+
+
+def safe_method(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            # Never raise into the host app, but keep count so get_stats() can surface it
+            record_swallowed_error(func)
+    return wrapper
+
+
+class DecipherClient:
+    # Framework-agnostic capture pipeline:
+    # sampling -> fingerprint/dedup -> stack -> source context -> locals -> transport.
+    # Framework adapters subclass it and provide the request specific pieces.
+    def __init__(self, codebase_id, customer_id, endpoint=None, context_lines=40, batch_size=20,
+                 flush_interval=2.0, max_queue_size=1000, drop_policy="drop_newest", pool_size=4,
+                 connect_timeout=3.05, read_timeout=10.0, compress=True, source_cache_size=256,
+                 prewarm_source=None, max_value_length=2048, max_depth=3, max_collection_items=50,
+                 max_locals_bytes=256 * 1024, serializers=None, dedup_window=60.0,
+                 dedup_max_entries=1024, sample_rate=1.0, endpoint_sample_rates=None,
+                 max_events_per_second=None, rate_limit_burst=None, max_breadcrumbs=100,
+                 breadcrumb_level=logging.INFO, max_message_length=1024, capture_print=False,
+                 spool_dir=None, spool_max_bytes=50 * 1024 * 1024, spool_segment_bytes=1024 * 1024,
+                 max_request_body_bytes=16 * 1024, max_response_body_bytes=16 * 1024,
+                 defer_capture=True, json_encoder="auto", compression="gzip", in_app_include=None,
+                 in_app_exclude=None, max_frames=100, aggregator_socket=None, enable_metrics=False,
+                 statsd_host=None, statsd_port=8125, statsd_interval=10.0, prometheus_port=None,
+                 source_mode=INLINE, source_endpoint=None, max_sent_sources=4096,
+                 track_latency=False, slow_request_threshold=None, latency_interval=60.0,
+                 max_latency_routes=512, profile_slow_requests=False, profiler_interval=0.01,
+                 capture_unhandled=False):
+        self.codebase_id = codebase_id
+        self.customer_id = customer_id
+        self.endpoint = endpoint or DEFAULT_ENDPOINT
+        self.context_lines = context_lines
+        self.max_breadcrumbs = max_breadcrumbs
+        self.max_message_length = max_message_length
+        self.max_request_body_bytes = max_request_body_bytes
+        self.max_response_body_bytes = max_response_body_bytes
+        # Leave source lookup, repr and encoding to the transport worker
+        self.defer_capture = defer_capture
+        # Self-instrumentation; when disabled every call site only pays an `is not None` test
+        self.metrics = None
+        if enable_metrics or statsd_host or prometheus_port:
+            self.metrics = Metrics()
+
+        # Hand events to a per-host forwarder process instead of uploading from every worker
+        self.aggregator_socket = aggregator_socket
+        self.spool = None
+        if spool_dir:
+            self.spool = DiskSpool(spool_dir, max_segment_bytes=spool_segment_bytes,
+                                   max_total_bytes=spool_max_bytes)
+        self.transport = self.create_transport(
+            pool_size=pool_size, connect_timeout=connect_timeout, read_timeout=read_timeout,
+            compress=compress, batch_size=batch_size, flush_interval=flush_interval,
+            max_queue_size=max_queue_size, drop_policy=drop_policy, json_encoder=json_encoder,
+            compression=compression)
+
+        # Library frames only report file, line and function; in-app frames get source and locals
+        self.frame_classifier = FrameClassifier(in_app_include, in_app_exclude)
+        self.max_frames = max_frames
+        self.source_cache = SourceCache(max_files=source_cache_size)
+        # "hash": in-app frames reference their file by content hash instead of inlining code
+        if source_mode not in (INLINE, HASH):
+            raise ValueError("source_mode must be '%s' or '%s'" % (INLINE, HASH))
+        self.source_uploader = None
+        if source_mode == HASH:
+            self.source_uploader = SourceUploader(
+                source_endpoint or default_source_endpoint(self.endpoint),
+                max_entries=max_sent_sources, connect_timeout=connect_timeout,
+                read_timeout=read_timeout, compress=compress, compression=compression)
+        if prewarm_source:
+            # True prewarms modules under the working directory, otherwise a list of roots
+            roots = [os.getcwd()] if prewarm_source is True else prewarm_source
+            self.source_cache.prewarm(roots)
+        self.serializer = SafeSerializer(max_value_length=max_value_length, max_depth=max_depth,
+                                         max_items=max_collection_items,
+                                         max_event_bytes=max_locals_bytes,
+                                         serializers=serializers)
+        self.deduplicator = None
+        # Only used in process pool workers, see attach_event
+        self.attached_fingerprints = None
+        if dedup_window:
+            self.deduplicator = Deduplicator(window=dedup_window, max_entries=dedup_max_entries)
+            self.attached_fingerprints = RecentFingerprints(dedup_window, dedup_max_entries)
+            self.transport.flush_hooks.append(self.get_aggregate_events)
+        self.sampler = Sampler(sample_rate=sample_rate, endpoint_sample_rates=endpoint_sample_rates,
+                               max_events_per_second=max_events_per_second,
+                               burst=rate_limit_burst)
+        # Opt-in: adapters only time requests when this is set, the default success path stays
+        # free of per-request hooks. slow_request_threshold is in seconds.
+        self.latency = None
+        self.slow_request_threshold = slow_request_threshold
+        if track_latency or slow_request_threshold:
+            self.latency = LatencyTracker(interval=latency_interval, max_routes=max_latency_routes)
+            self.transport.flush_hooks.append(self.get_latency_events)
+        # Opt-in: samples in-flight requests so slow_request events show where the time went
+        self.profiler = None
+        if profile_slow_requests and slow_request_threshold:
+            self.profiler = SamplingProfiler(interval=profiler_interval)
+
+        # breadcrumb_level only filters what the logging configuration lets through: records
+        # below a logger's effective level (WARNING for an unconfigured root) are never created
+        self.breadcrumb_handler = BreadcrumbHandler(self.get_breadcrumbs, level=breadcrumb_level)
+        install_handler(self.breadcrumb_handler)
+        self.original_print = _original_print
+        if capture_print:
+            self.override_print()
+
+        self.statsd_exporter = None
+        if statsd_host:
+            self.statsd_exporter = StatsdExporter(self.get_stats, host=statsd_host, port=statsd_port,
+                                                  interval=statsd_interval).start()
+        self.prometheus_exporter = None
+        if prometheus_port:
+            self.prometheus_exporter = serve_prometheus(self.get_stats, port=prometheus_port)
+
+        # Wrapped executor work and the excepthooks report through the latest client
+        set_client(self)
+        if capture_unhandled:
+            install_excepthooks()
+
+    def create_transport(self, pool_size, connect_timeout, read_timeout, compress, batch_size,
+                         flush_interval, max_queue_size, drop_policy, json_encoder, compression):
+        # Background thread batching uploads; the ASGI adapter swaps in an asyncio transport
+        sender = HttpSender(self.endpoint, pool_size=pool_size, connect_timeout=connect_timeout,
+                            read_timeout=read_timeout, compress=compress,
+                            json_encoder=json_encoder, compression=compression,
+                            metrics=self.metrics)
+        if self.aggregator_socket:
+            # Uploads directly only while the forwarder is unreachable
+            sender = SocketSender(self.aggregator_socket, fallback=sender,
+                                  json_encoder=json_encoder)
+        return BatchTransport(sender, batch_size=batch_size, flush_interval=flush_interval,
+                              max_queue_size=max_queue_size, drop_policy=drop_policy,
+                              spool=self.spool, metrics=self.metrics)
+
+    def get_breadcrumbs(self):
+        # Extended by adapters with the current request's Breadcrumbs. Outside of a request,
+        # those of the request that submitted the running work (see wrap_executor), if any.
+        context = current_context.get()
+        return context.breadcrumbs if context is not None else None
+
+    def get_user(self):
+        context = current_context.get()
+        return context.user if context is not None else None
+
+    def get_context_fields(self):
+        # Overridden by adapters: plain request metadata that background work should carry
+        return None
+
+    def capture_context(self):
+        # The current request as a CapturedContext, or the propagated one when called from work
+        # that was itself submitted by a request
+        fields = self.get_context_fields()
+        if fields is None:
+            return current_context.get()
+        return CapturedContext(fields, self.get_breadcrumbs(), self.get_user())
+
+    def wrap_callable(self, func, capture_errors=True):
+        return ContextCallable(func, self.capture_context(), capture_errors)
+
+    def wrap_executor(self, executor, capture_errors=True):
+        return ContextExecutor(executor, self, capture_errors)
+
+    @safe_method
+    def capture_exception(self, exception, collect_fields, endpoint=None, path=None):
+        # collect_fields() returns the request specific part of the event and is only called
+        # once the event survived sampling and deduplication. Expensive values in it should be
+        # wrapped in Deferred so they are computed off the request thread.
+        remote_event = getattr(exception, "_decipher_event", None)
+        if remote_event is not None:
+            exception._decipher_event = None
+            return self.capture_remote_event(*remote_event)
+        if getattr(exception, "_decipher_captured", False):
+            # Already reported where it was raised, e.g. in an executor worker
+            return False
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        if not self.sampler.should_capture(endpoint, path):
+            # Decided once: an executor's done callback must not give it another chance
+            self.mark_captured(exception)
+            return False
+        # Fingerprint first so repeats of a known error skip building the payload entirely
+        error_fingerprint = fingerprint(exception)
+        if self.deduplicator and not self.deduplicator.should_send(error_fingerprint, type(exception).__name__):
+            self.mark_captured(exception)
+            if metrics is not None:
+                metrics.increment("events_deduplicated")
+            return False
+        fields = collect_fields()
+        fields["fingerprint"] = error_fingerprint
+        self.send_to_decipher(self.snapshot(exception, fields))
+        self.mark_captured(exception)
+        if metrics is not None:
+            # Time spent on the request thread, materializing is measured separately
+            metrics.increment("events_captured")
+            metrics.observe("capture_request_seconds", time.perf_counter() - start)
+        return True
+
+    def capture_remote_event(self, error_fingerprint, exception_type, event):
+        # Built by a process pool worker (see attach_event). Sampling, rate limiting and
+        # deduplication happen here so they apply across all the workers.
+        if not self.sampler.should_capture():
+            return False
+        if self.deduplicator and not self.deduplicator.should_send(error_fingerprint, exception_type):
+            if self.metrics is not None:
+                self.metrics.increment("events_deduplicated")
+            return False
+        if event is None:
+            # The worker had already sent this error within the window and skipped building it
+            return False
+        self.send_to_decipher(event)
+        if self.metrics is not None:
+            self.metrics.increment("events_captured")
+        return True
+
+    @safe_method
+    def capture_background_exception(self, exception, is_uncaught_exception=True):
+        # Errors outside of a request: executor workers, threads, scripts. Carries the request
+        # context of the submitting request when there is one.
+        context = current_context.get()
+        return self.capture_exception(
+            exception, lambda: self.prepare_background_data(context, is_uncaught_exception))
+
+    def prepare_background_data(self, context, is_uncaught_exception):
+        data = {
+            "request_url": None,
+            "request_endpoint": None,
+            "request_headers": {},
+        }
+        messages = []
+        user = None
+        if context is not None:
+            data.update(context.fields)
+            if context.breadcrumbs is not None:
+                messages = Deferred(context.breadcrumbs.snapshot().format, self.max_message_length)
+            user = context.user
+        data.update({
+            "request_body": None,
+            "response_body": {},
+            "status_code": 0,
+            "is_uncaught_exception": is_uncaught_exception,
+            "messages": messages,
+            "affected_user": user,
+            "thread_name": threading.current_thread().name,
+        })
+        return data
+
+    @safe_method
+    def attach_event(self, exception):
+        # Process pool workers may exit before their transport flushes: materialize the event
+        # now and let it travel back to the parent pickled with the exception. The parent
+        # samples and deduplicates, repeats of an error this worker already built only carry
+        # the fingerprint.
+        if getattr(exception, "_decipher_captured", False):
+            return
+        error_fingerprint = fingerprint(exception)
+        event = None
+        if self.attached_fingerprints is None or self.attached_fingerprints.add(error_fingerprint):
+            fields = self.prepare_background_data(current_context.get(), True)
+            fields["fingerprint"] = error_fingerprint
+            fields["process_id"] = os.getpid()
+            event = self.snapshot(exception, fields)
+            if isinstance(event, DeferredEvent):
+                event = event.materialize()
+        exception._decipher_event = (error_fingerprint, type(exception).__name__, event)
+        self.mark_captured(exception)
+
+    def mark_captured(self, exception):
+        try:
+            exception._decipher_captured = True
+        except (AttributeError, TypeError):
+            # Some C-level exceptions take no attributes; they may get reported twice
+            pass
+
+    @safe_method
+    def start_profile(self, anchor=None):
+        # Called by adapters when a request starts; None unless slow requests are profiled
+        if self.profiler is not None:
+            return self.profiler.start(anchor)
+        return None
+
+    @safe_method
+    def record_request(self, method, route, duration, collect_fields, path=None, profile=None):
+        # Called by adapters at the end of every request while latency tracking is on. Slow
+        # requests share the sampler's budget with errors so a slow backend cannot flood ingest.
+        if profile is not None:
+            self.profiler.stop(profile)
+        route = "%s %s" % (method, route or UNMATCHED)
+        self.latency.observe(route, duration)
+        threshold = self.slow_request_threshold
+        if not threshold or duration < threshold or not self.sampler.should_capture(route, path):
+            return False
+        fields = collect_fields()
+        fields.update({
+            "event_type": "slow_request",
+            "route": route,
+            "duration_ms": round(duration * 1000, 3),
+            "threshold_ms": round(threshold * 1000, 3),
+        })
+        if profile is not None and profile.samples:
+            # No samples: e.g. a sync endpoint running in an asyncio server's threadpool, where
+            # the anchored task only awaits the worker thread
+            fields["profile"] = Deferred(profile.collapsed, self.profiler.interval)
+        self.send_to_decipher(self.snapshot(None, fields))
+        return True
+
+    def snapshot(self, exception, fields):
+        frames = []
+        exception_type = exception_message = None
+        if exception is not None:
+            exception_type = type(exception).__name__
+            exception_message = str(exception)
+            tb = exception.__traceback__
+            depth = 0
+            walker = tb
+            while walker is not None:
+                depth += 1
+                walker = walker.tb_next
+            if self.max_frames and depth > self.max_frames:
+                # Recursion-heavy stack: keep the innermost frames, where the error happened
+                fields["frames_omitted"] = depth - self.max_frames
+                for _ in range(depth - self.max_frames):
+                    tb = tb.tb_next
+            is_in_app = self.frame_classifier.is_in_app
+            any_in_app = False
+            for frame, line_number in traceback.walk_tb(tb):
+                code = frame.f_code
+                in_app = is_in_app(frame)
+                any_in_app = any_in_app or in_app
+                # Shallow copy: the frame keeps running (or is reused) after we return
+                f_locals = dict(frame.f_locals) if in_app else None
+                frames.append((code.co_filename, code.co_name, line_number, f_locals))
+            if frames and not any_in_app:
+                # Raised and caught entirely in library code, show where it was raised at least
+                filename, function_name, line_number, _ = frames[-1]
+                frames[-1] = (filename, function_name, line_number, dict(frame.f_locals))
+        event = DeferredEvent(self, self.get_timestamp(), frames, exception_type,
+                              exception_message, fields)
+        if not self.defer_capture:
+            return event.materialize()
+        return event
+
+    @safe_method
+    def materialize_event(self, event):
+        if self.metrics is not None:
+            start = time.perf_counter()
+        data = {
+            "codebase_id": self.codebase_id,
+            "customer_id": self.customer_id,
+            "timestamp": event.timestamp,
+            "error_stack": self.format_frames(event.frames, event.exception_type,
+                                              event.exception_message),
+        }
+        data.update(resolve_fields(event.fields))
+        if self.metrics is not None:
+            self.metrics.observe("capture_materialize_seconds", time.perf_counter() - start)
+        return data
+
+    @safe_method
+    def get_stack_trace_with_code(self, exception):
+        if exception is None:
+            return []
+        event = self.snapshot(exception, {})
+        if isinstance(event, DeferredEvent):
+            # snapshot() already materialized it when defer_capture is off
+            event = self.materialize_event(event)
+        return event["error_stack"]
+
+    def format_frames(self, frames, exception_type=None, exception_message=None):
+        formatted_trace = []
+        context = self.context_lines
+        budget = self.serializer.new_budget()
+        uploader = self.source_uploader
+        for filename, function_name, line_number, f_locals in frames:
+            if f_locals is None:
+                formatted_trace.append({
+                    "file": filename,
+                    "line": line_number,
+                    "function": function_name,
+                    "in_app": False,
+                })
+                continue
+            if uploader is not None:
+                # Uploaded at most once per file version, before the event referencing it.
+                # Falls back to inline code when the source cannot be stored.
+                digest, lines = self.source_cache.get_digest(filename)
+                if digest is not None and uploader.ensure(digest, lines):
+                    formatted_trace.append({
+                        "file": filename,
+                        "line": line_number,
+                        "function": function_name,
+                        "source_hash": digest,
+                        "locals": self.get_local_variables(f_locals, budget),
+                        "in_app": True,
+                    })
+                    continue
+            start_line = max(1, line_number - context)
+            code_context = self.get_code_context(filename, line_number, context)
+            locals = self.get_local_variables(f_locals, budget)
+            highlight_index = line_number - start_line
+            if highlight_index >= len(code_context):
+                highlight_index = len(code_context) - 1
+            formatted_trace.append({
+                "file": filename,
+                "line": line_number,
+                "function": function_name,
+                "code": code_context,
+                "highlight_index": highlight_index,
+                "start_line": start_line,
+                "locals": locals,
+                "in_app": True,
+            })
+
+        # Add the exception type and message to the last trace
+        if formatted_trace:
+            formatted_trace[-1].update({
+                "exception_type": exception_type,
+                "exception_message": exception_message
+            })
+        return formatted_trace
+
+    @safe_method
+    def get_code_context(self, filename, line_number, context=5):
+        start_line = max(1, line_number - context)
+        end_line = line_number + context
+        try:
+            return self.source_cache.get_lines(filename, start_line, end_line)
+        except Exception as e:
+            return ["Error reading line: " + str(e)]
+
+    @safe_method
+    def get_local_variables(self, f_locals, budget=None):
+        return self.serializer.serialize_locals(f_locals, budget)
+
+    @safe_method
+    def safe_repr(self, value):
+        return self.serializer.serialize(value)
+
+    @safe_method
+    def get_messages(self):
+        breadcrumbs = self.get_breadcrumbs()
+        if breadcrumbs is None:
+            return []
+        return breadcrumbs.format(self.max_message_length)
+
+    @safe_method
+    def get_aggregate_events(self):
+        events = []
+        for aggregate in self.deduplicator.drain_aggregates():
+            aggregate.update({
+                "event_type": "aggregate",
+                "codebase_id": self.codebase_id,
+                "customer_id": self.customer_id,
+                "timestamp": self.get_timestamp(),
+                "first_seen": self.format_timestamp(aggregate["first_seen"]),
+                "last_seen": self.format_timestamp(aggregate["last_seen"]),
+            })
+            events.append(aggregate)
+        return events
+
+    @safe_method
+    def get_latency_events(self):
+        drained = self.latency.drain()
+        if drained is None:
+            return []
+        period_start, period_end, routes = drained
+        return [{
+            "event_type": "latency",
+            "codebase_id": self.codebase_id,
+            "customer_id": self.customer_id,
+            "timestamp": self.get_timestamp(),
+            "period_start": self.format_timestamp(period_start),
+            "period_end": self.format_timestamp(period_end),
+            "routes": routes,
+        }]
+
+    @safe_method
+    def send_to_decipher(self, data):
+        # Only enqueues, the upload (and materializing a DeferredEvent) happens in the background
+        self.transport.enqueue(data)
+
+    @safe_method
+    def override_print(self):
+        # Patched once for the whole process, messages are routed to the current request
+        builtins.print = self.custom_print
+
+    @safe_method
+    def restore_print(self):
+        builtins.print = self.original_print
+
+    def custom_print(self, *args, **kwargs):
+        self.record_print(args)
+        self.original_print(*args, **kwargs)
+
+    @safe_method
+    def record_print(self, args):
+        breadcrumbs = self.get_breadcrumbs()
+        if breadcrumbs is not None:
+            # Keep the raw args, they are only joined into a message if an error gets reported
+            breadcrumbs.add_print(args)
+
+    def get_timestamp(self):
+        # To Do confirm this is right time format
+        return datetime.utcnow().isoformat() + 'Z'
+
+    def format_timestamp(self, epoch_seconds):
+        return datetime.utcfromtimestamp(epoch_seconds).isoformat() + 'Z'
+
+    def get_sampling_stats(self):
+        return self.sampler.stats()
+
+    def get_stats(self):
+        # Counters, gauges and histograms about the SDK itself; the cheap ones are always there
+        stats = self.metrics.snapshot() if self.metrics is not None else {"counters": {}, "histograms": {}}
+        stats["enabled"] = self.metrics is not None
+        stats["counters"]["events_dropped"] = self.transport.dropped
+        stats["counters"].update(self.sampler.stats())
+        stats["gauges"] = {"queue_depth": self.transport.queue_depth()}
+        stats["swallowed_errors"] = get_swallowed_errors()
+        return stats
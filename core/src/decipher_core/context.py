@@ -0,0 +1,140 @@
+import os
+import sys
+import threading
+from contextvars import ContextVar
+
+# Request context carried into executor workers and background threads. Adapters fall back to it
+# when there is no framework request around.
+current_context = ContextVar("decipher_context", default=None)
+
+# The most recently initialized client, looked up when work runs so wrapped callables stay
+# picklable for process pools
+_client = None
+_excepthooks_installed = False
+
+
+def set_client(client):
+    global _client
+    _client = client
+
+
+def get_client():
+    return _client
+
+
+class CapturedContext:
+    # Request metadata (plain data), breadcrumbs and user of the request that submitted some work.
+    # Threads share the breadcrumbs with the request; process pools get a pickled copy.
+    __slots__ = ("fields", "breadcrumbs", "user")
+
+    def __init__(self, fields=None, breadcrumbs=None, user=None):
+        self.fields = fields or {}
+        self.breadcrumbs = breadcrumbs
+        self.user = user
+
+    def __getstate__(self):
+        return self.fields, self.breadcrumbs, self.user
+
+    def __setstate__(self, state):
+        self.fields, self.breadcrumbs, self.user = state
+
+
+class ContextCallable:
+    # Runs `func` with the submitter's context and reports exceptions escaping it. A module level
+    # class rather than a closure so ProcessPoolExecutor can pickle it.
+    def __init__(self, func, context, capture_errors=True):
+        self.func = func
+        self.context = context
+        self.capture_errors = capture_errors
+        self.pid = os.getpid()
+
+    def __call__(self, *args, **kwargs):
+        token = current_context.set(self.context)
+        try:
+            return self.func(*args, **kwargs)
+        except Exception as e:
+            if self.capture_errors:
+                self.report(e)
+            raise
+        finally:
+            current_context.reset(token)
+
+    def report(self, exception):
+        client = get_client()
+        if client is None:
+            return
+        if os.getpid() == self.pid:
+            client.capture_background_exception(exception)
+        else:
+            # A process pool worker whose transport would die with it: build the event here and
+            # let it travel back with the exception, the parent sends it
+            client.attach_event(exception)
+
+
+class ContextExecutor:
+    # Wraps a concurrent.futures executor so submitted work carries the request context. Errors
+    # are reported where they happen (threads) or when the future completes (processes).
+    def __init__(self, executor, client, capture_errors=True):
+        self.executor = executor
+        self.client = client
+        self.capture_errors = capture_errors
+
+    def submit(self, fn, *args, **kwargs):
+        future = self.executor.submit(
+            ContextCallable(fn, self.client.capture_context(), self.capture_errors), *args, **kwargs)
+        if self.capture_errors:
+            future.add_done_callback(self._done)
+        return future
+
+    def map(self, fn, *iterables, **kwargs):
+        return self.executor.map(
+            ContextCallable(fn, self.client.capture_context(), self.capture_errors),
+            *iterables, **kwargs)
+
+    def _done(self, future):
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            # Already reported exceptions are skipped, events built by a child process are sent
+            self.client.capture_background_exception(exception)
+
+    def shutdown(self, *args, **kwargs):
+        return self.executor.shutdown(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.executor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True)
+        return False
+
+
+def _sys_excepthook(exc_type, exc_value, exc_traceback):
+    client = _client
+    if client is not None and issubclass(exc_type, Exception):
+        client.capture_background_exception(exc_value)
+    _previous_sys_excepthook(exc_type, exc_value, exc_traceback)
+
+
+def _threading_excepthook(args):
+    client = _client
+    if client is not None and issubclass(args.exc_type, Exception):
+        client.capture_background_exception(args.exc_value)
+    _previous_threading_excepthook(args)
+
+
+def install_excepthooks():
+    # Chains sys.excepthook and threading.excepthook once per process; events go to whichever
+    # client was initialized last
+    global _excepthooks_installed, _previous_sys_excepthook, _previous_threading_excepthook
+    if _excepthooks_installed:
+        return
+    _excepthooks_installed = True
+    _previous_sys_excepthook = sys.excepthook
+    _previous_threading_excepthook = threading.excepthook
+    sys.excepthook = _sys_excepthook
+    threading.excepthook = _threading_excepthook
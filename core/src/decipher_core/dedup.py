@@ -0,0 +1,114 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from . import forksafe
+
+
+def fingerprint(exception):
+    exception_type = type(exception)
+    parts = [exception_type.__module__, exception_type.__qualname__]
+    tb = exception.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        parts.append(f"{code.co_filename}:{code.co_name}:{tb.tb_lineno}")
+        tb = tb.tb_next
+    return hashlib.sha1("|".join(parts).encode("utf-8", "replace")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("exception_type", "window_start", "last_seen", "suppressed")
+
+    def __init__(self, exception_type, now):
+        self.exception_type = exception_type
+        self.window_start = now
+        self.last_seen = now
+        self.suppressed = 0
+
+
+class Deduplicator:
+    def __init__(self, window=60.0, max_entries=1024):
+        self.window = window
+        self.max_entries = max_entries
+        # fingerprint -> _Entry, oldest window first so expiry only looks at the front
+        self._entries = OrderedDict()
+        self._aggregates = []
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The parent reports what it suppressed, a child starts counting from zero
+        self._entries = OrderedDict()
+        self._aggregates = []
+        self._lock = threading.Lock()
+
+    def should_send(self, fingerprint, exception_type):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                entry.suppressed += 1
+                entry.last_seen = now
+                return False
+            self._entries[fingerprint] = _Entry(exception_type, now)
+            while len(self._entries) > self.max_entries:
+                self._retire(*self._entries.popitem(last=False))
+            return True
+
+    def drain_aggregates(self):
+        with self._lock:
+            self._expire(time.time())
+            aggregates, self._aggregates = self._aggregates, []
+        return aggregates
+
+    def _expire(self, now):
+        while self._entries:
+            fingerprint, entry = next(iter(self._entries.items()))
+            if now - entry.window_start < self.window:
+                break
+            del self._entries[fingerprint]
+            self._retire(fingerprint, entry)
+
+    def _retire(self, fingerprint, entry):
+        if entry.suppressed:
+            self._aggregates.append({
+                "fingerprint": fingerprint,
+                "exception_type": entry.exception_type,
+                "count": entry.suppressed,
+                "first_seen": entry.window_start,
+                "last_seen": entry.last_seen,
+            })
+
+
+class RecentFingerprints:
+    # Fingerprints seen within the last `window` seconds, without counting repeats. Lets a
+    # process pool worker skip building events the parent's Deduplicator will suppress anyway.
+    def __init__(self, window=60.0, max_entries=1024):
+        self.window = window
+        self.max_entries = max_entries
+        # fingerprint -> first seen, oldest first
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, fingerprint):
+        # False when the fingerprint was already seen within the window
+        now = time.time()
+        with self._lock:
+            while self._seen:
+                oldest, seen_at = next(iter(self._seen.items()))
+                if now - seen_at < self.window:
+                    break
+                del self._seen[oldest]
+            if fingerprint in self._seen:
+                return False
+            self._seen[fingerprint] = now
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return True
@@ -0,0 +1,45 @@
+class Deferred:
+    # A field value that is only computed when the event is materialized, e.g. decoding a body
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def resolve(self):
+        return self.func(*self.args)
+
+
+class DeferredEvent:
+    # What the request thread hands to the transport: frame locations, shallow copies of the
+    # frame locals and request metadata. Source lookup, repr and encoding happen in materialize().
+    __slots__ = ("client", "timestamp", "frames", "exception_type", "exception_message",
+                 "fields")
+
+    def __init__(self, client, timestamp, frames, exception_type, exception_message, fields):
+        self.client = client
+        self.timestamp = timestamp
+        # (filename, function, line_number, locals) from the outermost frame inwards
+        self.frames = frames
+        self.exception_type = exception_type
+        self.exception_message = exception_message
+        self.fields = fields
+
+    def materialize(self):
+        return self.client.materialize_event(self)
+
+
+def resolve_fields(fields):
+    return {key: value.resolve() if isinstance(value, Deferred) else value
+            for key, value in fields.items()}
+
+
+def materialize(events):
+    # Runs on the transport worker; snapshots that fail to materialize are dropped
+    materialized = []
+    for event in events:
+        if isinstance(event, DeferredEvent):
+            event = event.materialize()
+        if event is not None:
+            materialized.append(event)
+    return materialized
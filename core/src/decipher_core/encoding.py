@@ -0,0 +1,111 @@
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+AUTO = "auto"
+GZIP = "gzip"
+ZSTD = "zstd"
+
+
+class RawJson:
+    # A JSON document that arrived already encoded (e.g. a request body). Backends that can embed
+    # pre-encoded JSON copy it through instead of parsing it into objects and encoding it again.
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def parse(self):
+        try:
+            return json.loads(self.text)
+        except ValueError:
+            return self.text
+
+
+def _default(value):
+    if isinstance(value, RawJson):
+        return value.parse()
+    return str(value)
+
+
+def _orjson_default(value):
+    if not isinstance(value, RawJson):
+        return str(value)
+    try:
+        parsed = orjson.loads(value.text)
+    except orjson.JSONDecodeError:
+        return value.text
+    if hasattr(orjson, "Fragment"):
+        # Only validated above: a fragment is copied verbatim and must never break the payload
+        return orjson.Fragment(value.text)
+    return parsed
+
+
+def dumps_json(payload):
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_orjson(payload):
+    try:
+        return orjson.dumps(payload, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # orjson.JSONEncodeError, e.g. integers over 64 bits: the stdlib handles everything
+        return dumps_json(payload)
+
+
+def dumps_ujson(payload):
+    try:
+        return ujson.dumps(payload, default=_default, ensure_ascii=False).encode("utf-8")
+    except (TypeError, ValueError, OverflowError):
+        return dumps_json(payload)
+
+
+ENCODERS = {"orjson": dumps_orjson, "ujson": dumps_ujson, "json": dumps_json}
+
+
+def get_encoder(name=AUTO):
+    # Returns a callable turning a payload into UTF-8 JSON bytes
+    if name == AUTO:
+        name = "orjson" if orjson else "ujson" if ujson else "json"
+    if name not in ENCODERS:
+        raise ValueError("json_encoder must be one of %s" % ", ".join([AUTO] + list(ENCODERS)))
+    if (name == "orjson" and orjson is None) or (name == "ujson" and ujson is None):
+        # Requested backend is not installed
+        name = "json"
+    return ENCODERS[name]
+
+
+def loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def get_compression(name):
+    if name not in (None, GZIP, ZSTD):
+        raise ValueError("compression must be None, '%s' or '%s'" % (GZIP, ZSTD))
+    if name == ZSTD and zstd is None:
+        # Neither compression.zstd nor zstandard is available
+        return GZIP
+    return name
+
+
+def compress(body, method):
+    if method == ZSTD:
+        return zstd.compress(body, level=3)
+    return gzip.compress(body, compresslevel=6)
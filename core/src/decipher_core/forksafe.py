@@ -0,0 +1,22 @@
+import os
+import weakref
+
+# Objects owning threads, locks, sockets or connection pools. Only the forking thread survives
+# fork(), so in the child each of them gets _after_fork() called to start over.
+_registry = weakref.WeakSet()
+
+
+def register(obj):
+    _registry.add(obj)
+
+
+def _reinit_after_fork():
+    for obj in list(_registry):
+        try:
+            obj._after_fork()
+        except Exception as e:
+            pass
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
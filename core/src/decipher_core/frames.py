@@ -0,0 +1,82 @@
+import os
+import site
+import sysconfig
+
+# The SDK's own frames are never interesting to the user
+SDK_MODULES = ("decipher_sdk", "decipher_core")
+_LIBRARY_SEGMENTS = (os.sep + "site-packages" + os.sep, os.sep + "dist-packages" + os.sep)
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _library_roots():
+    paths = sysconfig.get_paths()
+    roots = [paths.get(key) for key in ("stdlib", "platstdlib", "purelib", "platlib")]
+    try:
+        roots.extend(site.getsitepackages())
+    except AttributeError:
+        # Old virtualenv builds ship a site module without it
+        pass
+    if site.ENABLE_USER_SITE:
+        roots.append(site.getusersitepackages())
+    normalized = set()
+    for root in roots:
+        if root:
+            normalized.add(_normalize(root))
+            normalized.add(_normalize(os.path.realpath(root)))
+    return tuple(sorted(root.rstrip(os.sep) + os.sep for root in normalized))
+
+
+def _split_rules(rules):
+    # Absolute paths are matched as prefixes of the file name, anything else as a module name
+    paths, modules = [], []
+    for rule in rules or ():
+        if os.path.isabs(rule):
+            paths.append(_normalize(rule).rstrip(os.sep) + os.sep)
+        else:
+            modules.append(rule)
+    return tuple(paths), tuple(modules)
+
+
+def _module_matches(module, names):
+    return bool(module) and any(module == name or module.startswith(name + ".") for name in names)
+
+
+class FrameClassifier:
+    # Decides whether a frame belongs to the application or to a library (stdlib, site-packages,
+    # the SDK itself). The answer only depends on the code object, so it is cached per code.
+    def __init__(self, in_app_include=None, in_app_exclude=None, max_cache=4096):
+        self.include_paths, self.include_modules = _split_rules(in_app_include)
+        self.exclude_paths, self.exclude_modules = _split_rules(in_app_exclude)
+        self.exclude_modules += SDK_MODULES
+        self.library_roots = _library_roots()
+        self.max_cache = max_cache
+        self._cache = {}
+
+    def is_in_app(self, frame):
+        code = frame.f_code
+        in_app = self._cache.get(code)
+        if in_app is None:
+            in_app = self.classify(code.co_filename, frame.f_globals.get("__name__"))
+            if len(self._cache) >= self.max_cache:
+                self._cache.clear()
+            self._cache[code] = in_app
+        return in_app
+
+    def classify(self, filename, module=None):
+        path = _normalize(filename) if filename and not filename.startswith("<") else None
+        if _module_matches(module, self.exclude_modules):
+            return False
+        if path is not None and path.startswith(self.exclude_paths):
+            return False
+        if _module_matches(module, self.include_modules):
+            return True
+        if path is not None and path.startswith(self.include_paths):
+            return True
+        if path is None:
+            # <frozen importlib._bootstrap> and friends are library code, <string> is exec'd code
+            return not filename.startswith("<frozen")
+        return not (path.startswith(self.library_roots) or any(
+            segment in path for segment in _LIBRARY_SEGMENTS))
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from . import forksafe
+from .metrics import DURATION_BUCKETS, Histogram
+
+# Requests that matched no route, and routes past max_routes, are folded into these
+UNMATCHED = "<unmatched>"
+OTHER = "<other>"
+
+
+class LatencyTracker:
+    # One fixed-bucket histogram per route template, so memory is constant per route and the
+    # number of routes is capped. Drained into a "latency" event once per interval; histograms
+    # from several workers or periods merge by adding their bucket counts.
+    def __init__(self, interval=60.0, max_routes=512, buckets=DURATION_BUCKETS):
+        self.interval = interval
+        self.max_routes = max_routes
+        self.buckets = buckets
+        self.histograms = {}
+        self.period_start = time.time()
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # Requests served by the parent are reported by the parent
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.period_start = time.time()
+
+    def observe(self, route, duration):
+        with self._lock:
+            histogram = self.histograms.get(route)
+            if histogram is None:
+                if len(self.histograms) >= self.max_routes:
+                    route = OTHER
+                    histogram = self.histograms.get(route)
+                if histogram is None:
+                    histogram = self.histograms[route] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def drain(self, force=False):
+        # (period_start, period_end, {route: histogram snapshot}) once the interval is over
+        now = time.time()
+        with self._lock:
+            if not self.histograms or (not force and now - self.period_start < self.interval):
+                return None
+            histograms, self.histograms = self.histograms, {}
+            period_start, self.period_start = self.period_start, now
+        return period_start, now, {route: h.snapshot() for route, h in histograms.items()}
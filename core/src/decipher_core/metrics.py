@@ -0,0 +1,286 @@
+import socket
+import threading
+import warnings
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import forksafe
+
+# Upper bounds, in seconds for durations and in bytes for payload sizes
+DURATION_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class _SwallowedErrors:
+    # Exceptions swallowed by safe_method, by function. Only touched when something failed.
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The parent's failures are reported by the parent
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+_swallowed_errors = _SwallowedErrors()
+
+
+def record_swallowed_error(func):
+    _swallowed_errors.record(getattr(func, "__qualname__", repr(func)))
+
+
+def get_swallowed_errors():
+    return _swallowed_errors.snapshot()
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One extra slot for observations above the last bound (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation, None past the last bound
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        cumulative = []
+        seen = 0
+        for count in self.counts:
+            seen += count
+            cumulative.append(seen)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], cumulative)),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    # Counters and fixed-bucket histograms about the SDK itself. Only created when metrics are
+    # enabled; call sites check for None so a disabled SDK pays a single attribute test.
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # Start from zero so summing the workers' metrics does not count the parent's again
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+            }
+
+
+def _metric_name(prefix, name):
+    return "%s_%s" % (prefix, name.replace(".", "_"))
+
+
+def format_prometheus(stats, prefix="decipher"):
+    # Text exposition format 0.0.4
+    lines = []
+    for name, value in sorted(stats.get("counters", {}).items()):
+        metric = _metric_name(prefix, name) + "_total"
+        lines += ["# TYPE %s counter" % metric, "%s %s" % (metric, value)]
+    for name, value in sorted(stats.get("gauges", {}).items()):
+        metric = _metric_name(prefix, name)
+        lines += ["# TYPE %s gauge" % metric, "%s %s" % (metric, value)]
+    if stats.get("swallowed_errors"):
+        metric = _metric_name(prefix, "swallowed_errors") + "_total"
+        lines.append("# TYPE %s counter" % metric)
+        for function, count in sorted(stats["swallowed_errors"].items()):
+            lines.append('%s{function="%s"} %s' % (metric, function, count))
+    for name, histogram in sorted(stats.get("histograms", {}).items()):
+        metric = _metric_name(prefix, name)
+        lines.append("# TYPE %s histogram" % metric)
+        for bound, count in histogram["buckets"].items():
+            lines.append('%s_bucket{le="%s"} %s' % (metric, bound, count))
+        lines += ["%s_sum %s" % (metric, histogram["sum"]),
+                  "%s_count %s" % (metric, histogram["count"])]
+    return "\n".join(lines) + "\n"
+
+
+def format_statsd(stats, previous=None, prefix="decipher"):
+    # Counters are sent as deltas since `previous` (an earlier stats dict), gauges as values
+    previous = previous or {}
+    old_counters = previous.get("counters", {})
+    old_histograms = previous.get("histograms", {})
+    lines = []
+    for name, value in sorted(stats.get("counters", {}).items()):
+        delta = value - old_counters.get(name, 0)
+        if delta:
+            lines.append("%s.%s:%s|c" % (prefix, name, delta))
+    for name, value in sorted(stats.get("gauges", {}).items()):
+        lines.append("%s.%s:%s|g" % (prefix, name, value))
+    for name, histogram in sorted(stats.get("histograms", {}).items()):
+        old = old_histograms.get(name, {})
+        count = histogram["count"] - old.get("count", 0)
+        if count:
+            lines.append("%s.%s.count:%s|c" % (prefix, name, count))
+            lines.append("%s.%s.avg:%s|g" % (prefix, name,
+                                             (histogram["sum"] - old.get("sum", 0.0)) / count))
+        for quantile in ("p50", "p99"):
+            if histogram[quantile] is not None:
+                lines.append("%s.%s.%s:%s|g" % (prefix, name, quantile, histogram[quantile]))
+    return lines
+
+
+class StatsdExporter:
+    # Pushes get_stats() to a statsd daemon over UDP every `interval` seconds
+    def __init__(self, get_stats, host="127.0.0.1", port=8125, interval=10.0, prefix="decipher"):
+        self.get_stats = get_stats
+        self.address = (host, port)
+        self.interval = interval
+        self.prefix = prefix
+        self._previous = None
+        self._stopped = threading.Event()
+        self._thread = None
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The pushing thread did not survive the fork, every worker pushes its own metrics
+        running = self._thread is not None and not self._stopped.is_set()
+        self._previous = None
+        self._stopped = threading.Event()
+        self._thread = None
+        if running:
+            self.start()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="decipher-statsd", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def push(self):
+        stats = self.get_stats()
+        lines = format_statsd(stats, self._previous, self.prefix)
+        self._previous = stats
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Stay below common MTUs, one datagram per group of lines
+            packet = []
+            for line in lines:
+                if packet and sum(len(part) + 1 for part in packet) + len(line) > 1400:
+                    sock.sendto("\n".join(packet).encode("utf-8"), self.address)
+                    packet = []
+                packet.append(line)
+            if packet:
+                sock.sendto("\n".join(packet).encode("utf-8"), self.address)
+        finally:
+            sock.close()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.push()
+            except Exception as e:
+                pass
+
+
+class PrometheusExporter:
+    # Minimal /metrics endpoint on a daemon thread. Only one process can own the port: with
+    # several workers per host the first one to bind serves and the others skip it (give each
+    # worker its own port, or use statsd, to see all of them).
+    def __init__(self, get_stats, port=9464, host="127.0.0.1", prefix="decipher"):
+        self.get_stats = get_stats
+        self.address = (host, port)
+        self.prefix = prefix
+        self.server = None
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The serving thread stayed in the parent. Drop our copy of its socket and try to bind
+        # again, which only succeeds once the parent released the port.
+        if self.server is not None:
+            self.server.socket.close()
+            self.server = None
+            self.start()
+
+    def start(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = format_prometheus(exporter.get_stats(), exporter.prefix).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(self.address, Handler)
+        except OSError as e:
+            # Never take the host app down over metrics, e.g. another worker owns the port
+            warnings.warn("decipher: not serving Prometheus metrics on %s:%d: %s"
+                          % (self.address + (e,)), RuntimeWarning)
+            return self
+        server.daemon_threads = True
+        self.server = server
+        threading.Thread(target=server.serve_forever, name="decipher-prometheus",
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def serve_prometheus(get_stats, port=9464, host="127.0.0.1", prefix="decipher"):
+    return PrometheusExporter(get_stats, port, host, prefix).start()
@@ -0,0 +1,143 @@
+import sys
+import threading
+import time
+
+from . import forksafe
+from .frames import SDK_MODULES, _module_matches
+
+# Stacks past max_stacks distinct entries in one request are counted here
+TRUNCATED = "<truncated>"
+
+
+class ProfileSession:
+    # Samples of one in-flight request. `anchor` is the frame of the adapter's entry point for
+    # requests sharing a thread (asyncio): only samples with that frame on the stack belong here.
+    __slots__ = ("thread_id", "anchor", "started", "samples", "stacks")
+
+    def __init__(self, thread_id, anchor=None):
+        self.thread_id = thread_id
+        self.anchor = anchor
+        self.started = time.perf_counter()
+        self.samples = 0
+        # collapsed stack ("outer;inner") -> number of samples
+        self.stacks = {}
+
+    def collapsed(self, interval):
+        # Brendan Gregg's collapsed format, heaviest stacks first
+        stacks = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "interval_ms": round(interval * 1000, 3),
+            "samples": self.samples,
+            "stacks": ["%s %d" % (stack, count) for stack, count in stacks],
+        }
+
+
+class SamplingProfiler:
+    # One daemon thread snapshotting the stacks of in-flight requests with sys._current_frames().
+    # It only runs while at least one request is being profiled. Frequency, stack depth, distinct
+    # stacks per request and concurrently profiled requests are all capped.
+    def __init__(self, interval=0.01, max_depth=64, max_stacks=128, max_sessions=64):
+        self.interval = max(interval, 0.001)
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.max_sessions = max_sessions
+        self.sessions = []
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self.sessions = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, anchor=None):
+        # Returns None when too many requests are already being profiled
+        session = ProfileSession(threading.get_ident(), anchor)
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                return None
+            self.sessions.append(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="decipher-profiler",
+                                                daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return session
+
+    def stop(self, session):
+        with self._lock:
+            try:
+                self.sessions.remove(session)
+            except ValueError:
+                pass
+
+    def _run(self):
+        while True:
+            if not self.sessions:
+                self._wakeup.clear()
+                # Re-check after clearing so a session started in between is not missed
+                if not self.sessions:
+                    self._wakeup.wait()
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                pass
+
+    def sample(self):
+        with self._lock:
+            sessions = list(self.sessions)
+        if not sessions:
+            return
+        frames = sys._current_frames()
+        for session in sessions:
+            frame = frames.get(session.thread_id)
+            if frame is None:
+                continue
+            stack = self.walk(frame, session.anchor)
+            if stack is None:
+                # Another request's task is running on the shared thread
+                continue
+            session.samples += 1
+            key = ";".join(stack) if stack else "<sdk>"
+            if key not in session.stacks and len(session.stacks) >= self.max_stacks:
+                key = TRUNCATED
+            session.stacks[key] = session.stacks.get(key, 0) + 1
+
+    def walk(self, frame, anchor=None):
+        # Labels from the outermost frame inwards; stops at the anchor, None if it is not found
+        labels = []
+        while frame is not None:
+            if frame is anchor:
+                anchor = None
+                break
+            label = self.label(frame)
+            if label is not None:
+                labels.append(label)
+            frame = frame.f_back
+        if anchor is not None:
+            return None
+        # Keep the innermost frames of very deep stacks, that is where the time goes
+        del labels[self.max_depth:]
+        labels.reverse()
+        return labels
+
+    def label(self, frame):
+        # module.qualname, cached per code object like the in-app classification. The SDK's own
+        # frames (middleware, signal handlers) are left out.
+        code = frame.f_code
+        label = self._labels.get(code, False)
+        if label is False:
+            module = frame.f_globals.get("__name__")
+            if _module_matches(module, SDK_MODULES):
+                label = None
+            else:
+                label = "%s.%s" % (module or "<unknown>", getattr(code, "co_qualname", code.co_name))
+            if len(self._labels) >= 4096:
+                self._labels.clear()
+            self._labels[code] = label
+        return label
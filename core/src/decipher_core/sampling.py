@@ -0,0 +1,78 @@
+import random
+import threading
+import time
+
+from . import forksafe
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class Sampler:
+    def __init__(self, sample_rate=1.0, endpoint_sample_rates=None, max_events_per_second=None,
+                 burst=None):
+        self.sample_rate = sample_rate
+        # Keyed by endpoint name or URL path, the endpoint name wins when both match
+        self.endpoint_sample_rates = dict(endpoint_sample_rates or {})
+        self.bucket = TokenBucket(max_events_per_second, burst) if max_events_per_second else None
+        self.accepted = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self.accepted = self.sampled_out = self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def get_rate(self, endpoint=None, path=None):
+        rates = self.endpoint_sample_rates
+        if rates:
+            if endpoint is not None and endpoint in rates:
+                return rates[endpoint]
+            if path is not None and path in rates:
+                return rates[path]
+        return self.sample_rate
+
+    def should_capture(self, endpoint=None, path=None):
+        rate = self.get_rate(endpoint, path)
+        if rate < 1.0 and random.random() >= rate:
+            self._count("sampled_out")
+            return False
+        if self.bucket is not None and not self.bucket.take():
+            self._count("rate_limited")
+            return False
+        self._count("accepted")
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "sampled_out": self.sampled_out,
+                "rate_limited": self.rate_limited,
+            }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
@@ -0,0 +1,135 @@
+from collections.abc import Mapping, Sequence, Set
+
+BUDGET_EXCEEDED = "<not captured: event size budget exceeded>"
+
+_SCALARS = (int, float, bool, complex, type(None))
+# Sequences whose own repr is short whatever their length
+_OPAQUE = (range, memoryview)
+_SEQUENCES = {list: ("[", "]"), tuple: ("(", ")"), set: ("{", "}"), frozenset: ("frozenset({", "})")}
+
+
+class Budget:
+    def __init__(self, max_bytes):
+        self.remaining = max_bytes
+
+    def spend(self, size):
+        self.remaining -= size
+
+    @property
+    def exhausted(self):
+        return self.remaining <= 0
+
+
+class SafeSerializer:
+    def __init__(self, max_value_length=2048, max_depth=3, max_items=50,
+                 max_event_bytes=256 * 1024, serializers=None):
+        self.max_value_length = max_value_length
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_event_bytes = max_event_bytes
+        # type -> callable(value) returning a string, looked up along the MRO
+        self.serializers = dict(serializers or {})
+
+    def register(self, value_type, func):
+        self.serializers[value_type] = func
+
+    def new_budget(self):
+        return Budget(self.max_event_bytes)
+
+    def serialize_locals(self, f_locals, budget=None):
+        if budget is None:
+            budget = self.new_budget()
+        serialized = {}
+        for name, value in f_locals.items():
+            if budget.exhausted:
+                serialized[name] = BUDGET_EXCEEDED
+                continue
+            text = self.serialize(value)
+            budget.spend(len(name) + len(text))
+            serialized[name] = text
+        return serialized
+
+    def serialize(self, value):
+        try:
+            text = self._repr(value, 0, self.max_value_length)
+        except Exception as e:
+            return f"Error in repr: {e}"
+        return self._truncate(text, self.max_value_length)
+
+    def _truncate(self, text, limit):
+        if len(text) > limit:
+            return text[:limit] + "..."
+        return text
+
+    def _repr(self, value, depth, limit):
+        value_type = type(value)
+        if value_type in _SCALARS:
+            return repr(value)
+        if value_type is str or value_type is bytes or value_type is bytearray:
+            # Slice before repr so huge strings and blobs are never copied in full
+            if len(value) > limit:
+                return repr(value[:limit]) + "..."
+            return repr(value)
+
+        if self.serializers:
+            for cls in value_type.__mro__:
+                func = self.serializers.get(cls)
+                if func is not None:
+                    return self._truncate(str(func(value)), limit)
+
+        if value_type is dict:
+            return self._repr_mapping(value, depth, limit, "{", "}")
+        brackets = _SEQUENCES.get(value_type)
+        if brackets is not None:
+            if not value:
+                return repr(value)
+            text = self._repr_sequence(value, depth, limit, *brackets)
+            if value_type is tuple and len(value) == 1:
+                text = text[:-1] + ",)"
+            return text
+
+        # Subclasses and other containers (OrderedDict, Counter, defaultdict, deque, ...) go
+        # through the same caps instead of a full repr() that is only truncated afterwards
+        if isinstance(value, (str, bytes, bytearray)):
+            if len(value) > limit:
+                return repr(value[:limit]) + "..."
+            return repr(value)
+        name = value_type.__name__
+        if isinstance(value, Mapping):
+            return self._repr_mapping(value, depth, limit, name + "({", "})")
+        if isinstance(value, tuple) and hasattr(value_type, "_fields"):
+            # namedtuple: keep the field names
+            if depth >= self.max_depth:
+                return f"{name}(...{len(value)} items)"
+            return self._repr_items((f"{field}={self._repr(item, depth + 1, limit)}"
+                                     for field, item in zip(value_type._fields, value)),
+                                    len(value), name + "(", ")", limit)
+        if isinstance(value, Sequence) and value_type not in _OPAQUE:
+            return self._repr_sequence(value, depth, limit, name + "([", "])")
+        if isinstance(value, Set):
+            return self._repr_sequence(value, depth, limit, name + "({", "})")
+
+        return self._truncate(repr(value), limit)
+
+    def _repr_mapping(self, value, depth, limit, opening, closing):
+        if depth >= self.max_depth:
+            return f"{opening}...{len(value)} items{closing}"
+        return self._repr_items(((self._repr(k, depth + 1, limit) + ": " + self._repr(v, depth + 1, limit))
+                                 for k, v in value.items()), len(value), opening, closing, limit)
+
+    def _repr_sequence(self, value, depth, limit, opening, closing):
+        if depth >= self.max_depth:
+            return f"{opening}...{len(value)} items{closing}"
+        return self._repr_items((self._repr(item, depth + 1, limit) for item in value),
+                                len(value), opening, closing, limit)
+
+    def _repr_items(self, items, length, opening, closing, limit):
+        parts = []
+        size = len(opening)
+        for index, part in enumerate(items):
+            if index >= self.max_items or size > limit:
+                parts.append(f"...{length - index} more")
+                break
+            parts.append(part)
+            size += len(part) + 2
+        return opening + ", ".join(parts) + closing
@@ -0,0 +1,86 @@
+import hashlib
+import linecache
+import os
+import sys
+import threading
+import tokenize
+from collections import OrderedDict
+
+from . import forksafe
+
+
+class SourceCache:
+    def __init__(self, max_files=256):
+        self.max_files = max_files
+        # filename -> ((mtime_ns, size), lines, sha256 or None), least recently used first
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def get_lines(self, filename, start_line, end_line):
+        lines = self.get_file(filename)
+        if lines is None:
+            # Not a regular file (<string>, zip imports...), linecache knows how to ask the loader
+            return [linecache.getline(filename, i).rstrip() for i in range(start_line, end_line + 1)]
+        window = [line.rstrip() for line in lines[start_line - 1:end_line]]
+        # Pad past the end of the file like linecache does
+        window.extend([""] * (end_line - start_line + 1 - len(window)))
+        return window
+
+    def get_file(self, filename):
+        entry = self._get_entry(filename)
+        return entry[1] if entry is not None else None
+
+    def get_digest(self, filename):
+        # (sha256 of the file's text, lines), computed once per version of the file
+        entry = self._get_entry(filename)
+        if entry is None:
+            return None, None
+        key, lines, digest = entry
+        if digest is None:
+            digest = hashlib.sha256("".join(lines).encode("utf-8")).hexdigest()
+            with self._lock:
+                if self._files.get(filename) is entry:
+                    self._files[filename] = (key, lines, digest)
+        return digest, lines
+
+    def _get_entry(self, filename):
+        try:
+            stat = os.stat(filename)
+        except (OSError, ValueError):
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._files.get(filename)
+            if entry is not None and entry[0] == key:
+                self._files.move_to_end(filename)
+                return entry
+
+        try:
+            with tokenize.open(filename) as f:
+                lines = f.readlines()
+        except (OSError, SyntaxError, UnicodeDecodeError):
+            return None
+
+        entry = (key, lines, None)
+        with self._lock:
+            self._files[filename] = entry
+            self._files.move_to_end(filename)
+            while len(self._files) > self.max_files:
+                self._files.popitem(last=False)
+        return entry
+
+    def prewarm(self, roots):
+        roots = [os.path.abspath(root) + os.sep for root in roots]
+        for module in list(sys.modules.values()):
+            filename = getattr(module, "__file__", None)
+            if not filename or not filename.endswith(".py"):
+                continue
+            filename = os.path.abspath(filename)
+            if any(filename.startswith(root) for root in roots):
+                self.get_file(filename)
+                if len(self._files) >= self.max_files:
+                    return
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from .encoding import compress as compress_body
+from .transport import HttpSender
+
+INLINE = "inline"
+HASH = "hash"
+
+
+def default_source_endpoint(endpoint):
+    # https://host/api/exception_upload -> https://host/api/source
+    return endpoint.rsplit("/", 1)[0] + "/source"
+
+
+class SourceUploader(HttpSender):
+    # Uploads every distinct source file once, addressed by the sha256 of its text:
+    #   HEAD {endpoint}/{digest}  200 when the ingest side already has it (e.g. another worker)
+    #   PUT  {endpoint}/{digest}  the file as UTF-8 text
+    # Events then only carry the digest and line numbers of their in-app frames.
+    def __init__(self, endpoint, max_entries=4096, max_source_bytes=1024 * 1024,
+                 failure_ttl=300.0, initial_backoff=1.0, max_backoff=300.0, **options):
+        super().__init__(endpoint.rstrip("/"), pool_size=1, **options)
+        self.max_entries = max_entries
+        self.max_source_bytes = max_source_bytes
+        self.failure_ttl = failure_ttl
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        # Digests known to be stored, least recently used first
+        self._sent = OrderedDict()
+        # Digests the ingest side refused -> when to try again. While the whole endpoint is
+        # failing nothing is tried before _retry_at. Either way frames inline their code
+        # instead of each paying for two round trips.
+        self._failed = OrderedDict()
+        self._retry_at = 0.0
+        self._backoff = initial_backoff
+        self._lock = threading.Lock()
+
+    def _after_fork(self):
+        super()._after_fork()
+        self._lock = threading.Lock()
+
+    def ensure(self, digest, lines):
+        # True once the ingest side has the source; callers inline the code otherwise
+        now = time.monotonic()
+        with self._lock:
+            if digest in self._sent:
+                self._sent.move_to_end(digest)
+                return True
+            if now < self._retry_at or now < self._failed.get(digest, 0.0):
+                return False
+        body = "".join(lines).encode("utf-8")
+        if len(body) > self.max_source_bytes:
+            return self._refused(digest)
+        url = "%s/%s" % (self.endpoint, digest)
+        try:
+            response = self.session.head(url, timeout=self.timeout)
+            response.close()
+            if response.status_code >= 500 or response.status_code == 429:
+                return self._unavailable()
+            if response.status_code != 200:
+                headers = {"Content-Type": "text/plain; charset=utf-8"}
+                if self.compress and self.compression and len(body) >= self.compress_min_size:
+                    body = compress_body(body, self.compression)
+                    headers["Content-Encoding"] = self.compression
+                response = self.session.put(url, data=body, headers=headers,
+                                            timeout=self.timeout)
+                response.close()
+                if response.status_code >= 500 or response.status_code in (404, 405, 429):
+                    return self._unavailable()
+                if response.status_code >= 300:
+                    return self._refused(digest)
+        except requests.RequestException as e:
+            return self._unavailable()
+        with self._lock:
+            self._failed.pop(digest, None)
+            self._backoff = self.initial_backoff
+            self._sent[digest] = True
+            while len(self._sent) > self.max_entries:
+                self._sent.popitem(last=False)
+        return True
+
+    def _refused(self, digest):
+        # This file will not be stored (e.g. too large), others may still go through
+        with self._lock:
+            self._failed[digest] = time.monotonic() + self.failure_ttl
+            self._failed.move_to_end(digest)
+            while len(self._failed) > self.max_entries:
+                self._failed.popitem(last=False)
+        return False
+
+    def _unavailable(self):
+        # The endpoint is down, overloaded or has no source API: back off exponentially
+        with self._lock:
+            self._retry_at = time.monotonic() + self._backoff
+            self._backoff = min(self.max_backoff, self._backoff * 2)
+        return False
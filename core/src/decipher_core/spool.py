@@ -0,0 +1,229 @@
+import contextlib
+import glob
+import os
+import random
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, one process per spool directory
+    fcntl = None
+
+from . import forksafe
+from .encoding import get_encoder, loads
+
+_dumps = get_encoder()
+
+ACTIVE_SEGMENT = "active.seg"
+LOCK_FILE = "spool.lock"
+
+
+def encode_record(event):
+    # One line per event, prefixed with a CRC so torn writes from a crash are detected and skipped
+    body = _dumps(event)
+    return b"%08x %s\n" % (zlib.crc32(body), body)
+
+
+def decode_record(line):
+    try:
+        checksum, body = line.rstrip(b"\n").split(b" ", 1)
+        if int(checksum, 16) != zlib.crc32(body):
+            return None
+        return loads(body)
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class DiskSpool:
+    def __init__(self, directory, max_segment_bytes=1024 * 1024, max_total_bytes=50 * 1024 * 1024,
+                 max_segment_age=30.0, fsync=False):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_total_bytes = max_total_bytes
+        # An active segment older than this is sealed so the replayer can pick it up
+        self.max_segment_age = max_segment_age
+        self.fsync = fsync
+        self.active_path = os.path.join(directory, ACTIVE_SEGMENT)
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+        self._thread_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._thread_lock = threading.Lock()
+
+    def append(self, events):
+        data = b"".join(encode_record(event) for event in events)
+        if not data:
+            return
+        with self._locked():
+            with open(self.active_path, "ab") as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                size = f.tell()
+            if size >= self.max_segment_bytes:
+                self._seal()
+            self._enforce_total_size()
+
+    def claim(self):
+        # Atomically rename the oldest sealed segment so only one process replays it
+        with self._locked():
+            self._reclaim_abandoned()
+            segments = self._sealed_segments()
+            if not segments and self._active_is_stale():
+                self._seal()
+                segments = self._sealed_segments()
+            if not segments:
+                return None
+            path = segments[0]
+            claimed = "%s.%d.claim" % (path, os.getpid())
+            os.rename(path, claimed)
+            return claimed
+
+    def read(self, path):
+        events = []
+        with open(path, "rb") as f:
+            for line in f:
+                event = decode_record(line)
+                if event is not None:
+                    events.append(event)
+        return events
+
+    def release(self, path, unsent=()):
+        # Unsent events go back under the claimed segment's name so they keep their place in line
+        with self._locked():
+            if unsent:
+                original = path.rsplit(".", 2)[0]
+                tmp = original + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(b"".join(encode_record(event) for event in unsent))
+                os.rename(tmp, original)
+            os.remove(path)
+
+    def _seal(self):
+        if not os.path.exists(self.active_path) or os.path.getsize(self.active_path) == 0:
+            return
+        sealed = os.path.join(self.directory, "%020d-%d.seg" % (time.time_ns(), os.getpid()))
+        os.rename(self.active_path, sealed)
+
+    def _active_is_stale(self):
+        try:
+            stat = os.stat(self.active_path)
+        except OSError:
+            return False
+        return stat.st_size > 0 and time.time() - stat.st_mtime >= self.max_segment_age
+
+    def _sealed_segments(self):
+        return sorted(path for path in glob.glob(os.path.join(self.directory, "*.seg"))
+                      if os.path.basename(path) != ACTIVE_SEGMENT)
+
+    def _reclaim_abandoned(self):
+        # Claims left behind by a worker that died mid-replay
+        for path in glob.glob(os.path.join(self.directory, "*.seg.*.claim")):
+            pid = int(path.rsplit(".", 2)[1])
+            if pid != os.getpid() and not _pid_alive(pid):
+                os.rename(path, path.rsplit(".", 2)[0])
+
+    def _enforce_total_size(self):
+        segments = self._sealed_segments()
+        sizes = {path: os.path.getsize(path) for path in segments}
+        total = sum(sizes.values())
+        if os.path.exists(self.active_path):
+            total += os.path.getsize(self.active_path)
+        # Oldest segments are evicted first
+        for path in segments:
+            if total <= self.max_total_bytes:
+                break
+            os.remove(path)
+            total -= sizes[path]
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class SpoolReplayer:
+    def __init__(self, spool, sender, batch_size=20, poll_interval=5.0, initial_backoff=1.0,
+                 max_backoff=300.0):
+        self.spool = spool
+        self.sender = sender
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._backoff = initial_backoff
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._backoff = self.initial_backoff
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="decipher-spool-replayer", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                delivered = self.replay_once()
+            except Exception as e:
+                delivered = None
+            if delivered is None:
+                self._stopped.wait(self.poll_interval)
+            elif not delivered:
+                # Full jitter exponential backoff while the endpoint is unhealthy
+                self._stopped.wait(random.uniform(0, self._backoff))
+                self._backoff = min(self.max_backoff, self._backoff * 2)
+            else:
+                self._backoff = self.initial_backoff
+
+    def replay_once(self):
+        # None when there was nothing to replay, otherwise whether the whole segment went through
+        path = self.spool.claim()
+        if path is None:
+            return None
+        events = self.spool.read(path)
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            payload = batch[0] if len(batch) == 1 else batch
+            if not self.sender.send(payload):
+                self.spool.release(path, events[start:])
+                return False
+        self.spool.release(path)
+        return True
@@ -0,0 +1,322 @@
+import atexit
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import forksafe
+from .deferred import materialize
+from .encoding import GZIP, compress as compress_body, get_compression, get_encoder
+from .metrics import SIZE_BUCKETS
+from .spool import SpoolReplayer
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
+# Returned by senders when the ingest side refused the payload (4xx). Truthy like a delivery
+# because resending it would not help, counted separately.
+REJECTED = "rejected"
+
+# Placed on the queue to wake the worker up early when closing
+_WAKE = object()
+
+
+def encode_payload(payload, compress=True, compress_min_size=1024, encoder=None,
+                   compression=GZIP):
+    body = (encoder or get_encoder())(payload)
+    headers = {"Content-Type": "application/json"}
+    if compress and compression and len(body) >= compress_min_size:
+        body = compress_body(body, compression)
+        headers["Content-Encoding"] = compression
+    return body, headers
+
+
+def event_counter(delivered):
+    if delivered is REJECTED:
+        return "events_rejected"
+    return "events_sent" if delivered else "events_failed"
+
+
+def delivery_status(status_code):
+    # True, REJECTED (4xx other than 429) or False when it is worth retrying
+    if status_code >= 500 or status_code == 429:
+        return False
+    if status_code >= 400:
+        return REJECTED
+    return True
+
+
+class HttpSender:
+    def __init__(self, endpoint, pool_size=4, connect_timeout=3.05, read_timeout=10.0,
+                 compress=True, compress_min_size=1024, json_encoder="auto", compression=GZIP,
+                 metrics=None):
+        self.endpoint = endpoint
+        self.metrics = metrics
+        self.timeout = (connect_timeout, read_timeout)
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.encoder = get_encoder(json_encoder)
+        self.compression = get_compression(compression)
+        self.pool_size = pool_size
+        self.session = self._new_session()
+        forksafe.register(self)
+
+    def _new_session(self):
+        session = requests.Session()
+        # One persistent pool per scheme, sized for the number of concurrent uploaders
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _after_fork(self):
+        # Pooled connections are shared with the parent, never reuse them
+        self.session = self._new_session()
+
+    def send(self, payload):
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        body, headers = encode_payload(payload, self.compress, self.compress_min_size,
+                                       self.encoder, self.compression)
+        if metrics is not None:
+            encoded = time.perf_counter()
+            metrics.observe("encode_seconds", encoded - start)
+            metrics.observe("payload_bytes", len(body), SIZE_BUCKETS)
+        try:
+            response = self.session.post(self.endpoint, data=body, headers=headers,
+                                         timeout=self.timeout)
+        except requests.RequestException as e:
+            return False
+        finally:
+            if metrics is not None:
+                metrics.observe("upload_seconds", time.perf_counter() - encoded)
+        response.close()
+        return delivery_status(response.status_code)
+
+    def close(self):
+        self.session.close()
+
+
+class BatchTransport:
+    def __init__(self, sender, batch_size=20, flush_interval=2.0, max_queue_size=1000,
+                 drop_policy=DROP_NEWEST, spool=None, metrics=None):
+        if drop_policy not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("drop_policy must be '%s' or '%s'" % (DROP_NEWEST, DROP_OLDEST))
+        self.sender = sender
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.metrics = metrics
+        # Optional DiskSpool that failed and overflowing events are written to. Overflow is
+        # only parked here by enqueue(), the worker materializes and spools it.
+        self.spool = spool
+        self._overflow = []
+        self.replayer = SpoolReplayer(spool, sender, batch_size=self.batch_size) if spool else None
+        # Callables returning extra events (e.g. aggregates), polled once per flush interval
+        self.flush_hooks = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._worker = None
+        atexit.register(self.close)
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The worker thread did not survive the fork and queued events belong to the parent
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.dropped = 0
+        self._overflow = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._worker = None
+
+    def start(self):
+        self._ensure_worker()
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def enqueue(self, event):
+        if self._closed.is_set():
+            return False
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+
+        if self.spool is not None:
+            return self._park_overflow(event)
+        if self.drop_policy == DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(event)
+                self._count_drop()
+                return True
+            except queue.Full:
+                pass
+        self._count_drop()
+        return False
+
+    def close(self, timeout=5.0):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            try:
+                self.queue.put_nowait(_WAKE)
+            except queue.Full:
+                pass
+            worker.join(timeout)
+            if worker.is_alive():
+                return
+        # Worker never started or already exited, send whatever is left from here
+        self._drain()
+        if self.replayer is not None:
+            self.replayer.stop()
+        self.sender.close()
+
+    def _park_overflow(self, event):
+        # Never spools from the caller's thread: the file lock, the write and materializing the
+        # snapshot (source reads, repr, source uploads) all happen on the worker
+        with self._lock:
+            if len(self._overflow) < self.queue.maxsize:
+                self._overflow.append(event)
+                return True
+            self.dropped += 1
+        return False
+
+    def _spool_overflow(self):
+        with self._lock:
+            events, self._overflow = self._overflow, []
+        if events:
+            self._spool(events)
+
+    def _spool(self, events):
+        events = materialize(events)
+        try:
+            self.spool.append(events)
+            if self.metrics is not None:
+                self.metrics.increment("events_spooled", len(events))
+            return True
+        except OSError as e:
+            for _ in events:
+                self._count_drop()
+            return False
+        except Exception as e:
+            # An event the spool cannot encode, keep the others and the worker going
+            if len(events) > 1:
+                return all([self._spool([event]) for event in events])
+            self._count_drop()
+            return False
+
+    def _count_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                worker = threading.Thread(target=self._run, name="decipher-transport", daemon=True)
+                worker.start()
+                self._worker = worker
+                if self.replayer is not None:
+                    self.replayer.start()
+
+    def _run(self):
+        next_hooks = time.monotonic() + self.flush_interval
+        while True:
+            self._spool_overflow()
+            batch = self._next_batch()
+            if time.monotonic() >= next_hooks:
+                batch.extend(self._poll_hooks())
+                next_hooks = time.monotonic() + self.flush_interval
+            if batch:
+                self._send(batch)
+            elif self._closed.is_set():
+                self._drain()
+                return
+
+    def _poll_hooks(self):
+        events = []
+        for hook in self.flush_hooks:
+            try:
+                events.extend(hook())
+            except Exception as e:
+                pass
+        return events
+
+    def _next_batch(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if self._closed.is_set():
+                timeout = 0
+            elif deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _WAKE:
+                continue
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _WAKE:
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._send(batch)
+                batch = []
+        batch.extend(self._poll_hooks())
+        if batch:
+            self._send(batch)
+        self._spool_overflow()
+
+    def _send(self, batch):
+        batch = materialize(batch)
+        if not batch:
+            return True
+        # Single events keep the original upload format, larger batches go up as a JSON array
+        payload = batch[0] if len(batch) == 1 else batch
+        try:
+            delivered = self.sender.send(payload)
+        except Exception as e:
+            # Typically an event the encoder cannot handle. Never let it take the worker down:
+            # send the batch one event at a time so only the bad event is dropped.
+            if len(batch) > 1:
+                for event in batch:
+                    self._send([event])
+            else:
+                self._count_drop()
+            return False
+        if self.metrics is not None:
+            self.metrics.increment(event_counter(delivered), len(batch))
+        if delivered:
+            return True
+        if self.spool is not None:
+            self._spool(batch)
+        return False
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+# The stub ingest server lives with the benchmarks
+sys.path.insert(0, os.path.join(ROOT, "core", "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
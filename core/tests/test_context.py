@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from decipher_core.client import DecipherClient
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+
+
+class RecordingClient(DecipherClient):
+    def __init__(self, **options):
+        self.sent = []
+        super().__init__("cb", "cu", endpoint="http://127.0.0.1:9/", **options)
+
+    def send_to_decipher(self, data):
+        self.sent.append(data)
+
+
+def job(x):
+    return {}["missing"]
+
+
+def run(executor, jobs):
+    for future in [executor.submit(job, i) for i in range(jobs)]:
+        with pytest.raises(KeyError):
+            future.result()
+
+
+def test_process_pool_errors_are_deduplicated_by_the_parent():
+    client = RecordingClient()
+    with client.wrap_executor(ThreadPoolExecutor(2)) as executor:
+        run(executor, 10)
+    fork = multiprocessing.get_context("fork")
+    with client.wrap_executor(ProcessPoolExecutor(2, mp_context=fork)) as executor:
+        run(executor, 10)
+    assert len(client.sent) == 1
+    assert client.sampler.stats()["accepted"] == 20
+
+
+def test_process_pool_errors_are_sampled_by_the_parent():
+    client = RecordingClient(dedup_window=0, max_events_per_second=0.01, rate_limit_burst=3)
+    fork = multiprocessing.get_context("fork")
+    with client.wrap_executor(ProcessPoolExecutor(2, mp_context=fork)) as executor:
+        run(executor, 10)
+    assert len(client.sent) == 3
+    assert client.sampler.stats()["rate_limited"] == 7
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+import pytest
+
+from decipher_core.spool import DiskSpool, SpoolReplayer, encode_record
+from decipher_core.transport import BatchTransport
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+
+
+def dead_pid():
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+class FakeSender:
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def send(self, payload):
+        self.release.wait(5)
+        self.sent.append(payload)
+        return self.results.pop(0) if self.results else True
+
+    def close(self):
+        pass
+
+
+def test_torn_write_is_skipped(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_segment_age=0)
+    spool.append([{"n": 1}, {"n": 2}])
+    # A crash halfway through a write leaves a truncated record behind
+    with open(spool.active_path, "ab") as f:
+        f.write(encode_record({"n": 3})[:-6])
+    path = spool.claim()
+    assert spool.read(path) == [{"n": 1}, {"n": 2}]
+
+
+def test_corrupted_record_is_skipped(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_segment_age=0)
+    spool.append([{"n": 1}])
+    with open(spool.active_path, "ab") as f:
+        f.write(encode_record({"n": 2}).replace(b"2", b"7"))
+    spool.append([{"n": 3}])
+    assert spool.read(spool.claim()) == [{"n": 1}, {"n": 3}]
+
+
+def test_abandoned_claim_is_reclaimed(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_segment_age=0)
+    spool.append([{"n": 1}])
+    path = spool.claim()
+    # Pretend the claim belongs to a worker that died mid-replay
+    original = path.rsplit(".", 2)[0]
+    os.rename(path, "%s.%d.claim" % (original, dead_pid()))
+    reclaimed = spool.claim()
+    assert reclaimed == "%s.%d.claim" % (original, os.getpid())
+    assert spool.read(reclaimed) == [{"n": 1}]
+
+
+def test_live_claim_is_not_reclaimed(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_segment_age=0)
+    spool.append([{"n": 1}])
+    path = spool.claim()
+    original = path.rsplit(".", 2)[0]
+    os.rename(path, "%s.%d.claim" % (original, os.getppid()))
+    assert spool.claim() is None
+
+
+def test_release_puts_unsent_events_back(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_segment_age=0)
+    spool.append([{"n": 1}, {"n": 2}, {"n": 3}])
+    replayer = SpoolReplayer(spool, FakeSender([True, False]), batch_size=1)
+    assert replayer.replay_once() is False
+    assert spool.read(spool.claim()) == [{"n": 2}, {"n": 3}]
+
+
+def test_each_segment_is_claimed_by_one_process(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_segment_bytes=1)
+    for n in range(40):
+        spool.append([{"n": n}])
+    out = tmp_path / "claims"
+    out.mkdir()
+    children = []
+    for worker in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                claimed = []
+                while True:
+                    path = spool.claim()
+                    if path is None:
+                        break
+                    claimed.extend(event["n"] for event in spool.read(path))
+                    spool.release(path)
+                (out / str(worker)).write_text(" ".join(map(str, claimed)))
+            finally:
+                os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+    claimed = []
+    for f in out.iterdir():
+        claimed.extend(int(n) for n in f.read_text().split())
+    assert sorted(claimed) == list(range(40))
+    assert spool.claim() is None
+
+
+def test_overflow_is_spooled_by_the_worker(tmp_path):
+    threads = []
+
+    class RecordingSpool(DiskSpool):
+        def append(self, events):
+            threads.append(threading.current_thread().name)
+            super().append(events)
+
+    sender = FakeSender()
+    sender.release.clear()
+    transport = BatchTransport(sender, batch_size=1, flush_interval=0.05, max_queue_size=1,
+                               spool=RecordingSpool(str(tmp_path)))
+    transport.enqueue({"n": 0})
+    # The worker is now blocked sending the first event, the next fills the queue
+    deadline = time.monotonic() + 5
+    while transport.queue_depth() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert transport.enqueue({"n": 1})
+    assert transport.enqueue({"n": 2})
+    assert threads == []
+    sender.release.set()
+    transport.close()
+    assert threads == ["decipher-transport"]
+    spool = transport.spool
+    spool.max_segment_age = 0
+    assert spool.read(spool.claim()) == [{"n": 2}]
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+import pytest
+
+from decipher_core.async_transport import AsyncTransport
+from decipher_core.metrics import Metrics
+from decipher_core.sources import SourceUploader, default_source_endpoint
+from decipher_core.spool import DiskSpool
+from decipher_core.transport import DROP_NEWEST, DROP_OLDEST, REJECTED, BatchTransport, HttpSender
+from stub_ingest import StubIngest
+
+
+@pytest.fixture
+def stub():
+    stub = StubIngest().start()
+    yield stub
+    stub.stop()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_unencodable_event_does_not_kill_the_worker(stub):
+    transport = BatchTransport(HttpSender(stub.endpoint, json_encoder="json"), batch_size=1,
+                               flush_interval=0.05)
+    transport.enqueue({"affected_user": {"id": {b"k": 1}}})
+    wait_for(lambda: transport.dropped)
+    assert transport._worker.is_alive()
+    transport.enqueue({"n": 1})
+    wait_for(lambda: stub.events)
+    transport.close()
+    assert stub.events == 1
+    assert transport.dropped == 1
+
+
+def test_unencodable_event_only_drops_itself_from_a_batch(stub):
+    transport = BatchTransport(HttpSender(stub.endpoint, json_encoder="json"), batch_size=3,
+                               flush_interval=0.05)
+    transport.start()
+    transport.enqueue({"n": 0})
+    transport.enqueue({"affected_user": {"id": {b"k": 1}}})
+    transport.enqueue({"n": 2})
+    transport.close()
+    assert stub.events == 2
+    assert transport.dropped == 1
+
+
+def test_unencodable_event_only_drops_itself_from_the_spool(stub, tmp_path):
+    spool = DiskSpool(str(tmp_path), max_segment_age=0)
+    transport = BatchTransport(HttpSender(stub.endpoint), spool=spool)
+    assert not transport._spool([{"n": 0}, {"id": {b"k": 1}}, {"n": 2}])
+    assert transport.dropped == 1
+    assert spool.read(spool.claim()) == [{"n": 0}, {"n": 2}]
+
+
+def test_async_unencodable_event_does_not_stop_the_sender(stub):
+    async def main():
+        transport = AsyncTransport(stub.endpoint, batch_size=3, flush_interval=0.05,
+                                   json_encoder="json")
+        transport.enqueue({"n": 0})
+        transport.enqueue({"affected_user": {"id": {b"k": 1}}})
+        transport.enqueue({"n": 2})
+        await asyncio.sleep(0.3)
+        assert not transport._task.done()
+        transport.enqueue({"n": 3})
+        await transport.stop()
+        return transport
+
+    transport = asyncio.run(main())
+    assert stub.events == 3
+    assert transport.dropped == 1
+
+
+class GatedSender(HttpSender):
+    # Records payloads and holds the worker in send() until the gate opens
+    def __init__(self, endpoint, **options):
+        super().__init__(endpoint, **options)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.payloads = []
+
+    def send(self, payload):
+        self.gate.wait(5)
+        self.payloads.append(payload)
+        return super().send(payload)
+
+
+def test_events_are_batched(stub):
+    transport = BatchTransport(HttpSender(stub.endpoint), batch_size=5, flush_interval=0.5)
+    for n in range(12):
+        transport.enqueue({"n": n})
+    transport.close()
+    assert stub.events == 12
+    assert stub.requests == 3
+
+
+def test_large_payloads_are_gzipped(stub):
+    sender = HttpSender(stub.endpoint, compress_min_size=1024)
+    assert sender.send({"message": "x" * 10000}) is True
+    assert stub.wire_bytes < stub.json_bytes
+    stub.reset()
+    assert sender.send({"message": "x"}) is True
+    assert stub.wire_bytes == stub.json_bytes
+
+
+@pytest.mark.parametrize("policy, kept", [(DROP_NEWEST, [0, 1, 2]), (DROP_OLDEST, [0, 2, 3])])
+def test_drop_policy(stub, policy, kept):
+    sender = GatedSender(stub.endpoint)
+    sender.gate.clear()
+    transport = BatchTransport(sender, batch_size=1, flush_interval=0.05, max_queue_size=2,
+                               drop_policy=policy)
+    transport.enqueue({"n": 0})
+    # The worker holds event 0 in send(), the queue takes two more
+    assert wait_for(lambda: transport.queue_depth() == 0)
+    transport.enqueue({"n": 1})
+    transport.enqueue({"n": 2})
+    assert transport.enqueue({"n": 3}) is (policy == DROP_OLDEST)
+    sender.gate.set()
+    transport.close()
+    assert [payload["n"] for payload in sender.payloads] == kept
+    assert transport.dropped == 1
+
+
+@pytest.mark.parametrize("status, delivered, counter", [
+    (200, True, "events_sent"),
+    (400, REJECTED, "events_rejected"),
+    (429, False, "events_failed"),
+    (503, False, "events_failed"),
+])
+def test_rejected_and_failed_uploads(stub, status, delivered, counter):
+    stub.status = status
+    assert HttpSender(stub.endpoint).send({"n": 0}) == delivered
+    metrics = Metrics()
+    transport = BatchTransport(HttpSender(stub.endpoint), flush_interval=0.05, metrics=metrics)
+    transport.enqueue({"n": 0})
+    transport.close()
+    assert metrics.snapshot()["counters"] == {counter: 1}
+
+
+def test_async_transport_batches_and_counts(stub):
+    stub.status = 400
+    metrics = Metrics()
+
+    async def main():
+        transport = AsyncTransport(stub.endpoint, batch_size=5, flush_interval=0.5,
+                                   metrics=metrics)
+        for n in range(12):
+            transport.enqueue({"message": "x" * 200, "n": n})
+        await transport.stop()
+
+    asyncio.run(main())
+    assert stub.events == 12
+    assert stub.requests == 3
+    assert stub.wire_bytes < stub.json_bytes
+    assert metrics.snapshot()["counters"] == {"events_rejected": 12}
+
+
+def test_source_miss_is_uploaded_once(stub):
+    lines = ["x = 1\n", "y = 2\n"]
+    digest = hashlib.sha256("".join(lines).encode("utf-8")).hexdigest()
+    uploader = SourceUploader(default_source_endpoint(stub.endpoint))
+    assert uploader.ensure(digest, lines)
+    assert stub.sources[digest] == b"x = 1\ny = 2\n"
+    # Known digests are not looked up again
+    stub.stop()
+    assert uploader.ensure(digest, lines)
+
+
+def test_refused_source_is_not_retried(stub):
+    uploader = SourceUploader(default_source_endpoint(stub.endpoint))
+    # The stub refuses a body that does not match its digest
+    assert not uploader.ensure("0" * 64, ["x = 1\n"])
+    assert "0" * 64 in uploader._failed
+    stub.stop()
+    assert not uploader.ensure("0" * 64, ["x = 1\n"])
+
+
+def test_unreachable_source_endpoint_backs_off(stub):
+    stub.stop()
+    uploader = SourceUploader(default_source_endpoint(stub.endpoint), connect_timeout=0.5)
+    assert not uploader.ensure("1" * 64, ["x = 1\n"])
+    assert uploader._retry_at > time.monotonic()
+    start = time.monotonic()
+    assert not uploader.ensure("2" * 64, ["y = 1\n"])
+    assert time.monotonic() - start < 0.01
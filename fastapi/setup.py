@@ -12,7 +12,7 @@ setup(
     packages=find_packages(where='src'),
     install_requires=[
         'fastapi',  
-        'requests' 
+        'decipher-core[async]',
     ],
     python_requires='>=3.7',
 )
\ No newline at end of file
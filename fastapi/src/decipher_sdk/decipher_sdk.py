@@ -1,89 +1,197 @@
-import traceback
-import requests
-import json
-import builtins
-from datetime import datetime
 from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp
-import functools
 import asyncio
-import linecache
+import sys
+import time
 from contextvars import ContextVar
-from fastapi import Request
+from decipher_core.async_transport import AsyncTransport
+from decipher_core.body import BodyTee, ReceiveTee, decode_body, is_capturable
+from decipher_core.breadcrumbs import Breadcrumbs
+from decipher_core.client import DecipherClient
+from decipher_core.context import current_context
+from decipher_core.deferred import Deferred
 
-current_request = ContextVar("decipher_current_request")
-current_messages = ContextVar("current_messages", default=[])
-current_user = ContextVar("current_user", default=None)
+# The only per-request work on the success path is setting this; everything else is built lazily
+current_scope = ContextVar("decipher_current_scope", default=None)
 
-def safe_method(func):
-    @functools.wraps(func)
-    async def wrapper(*args, **kwargs):
-        try:
-            if asyncio.iscoroutinefunction(func):
-                return await func(*args, **kwargs)
-            else:
-                return func(*args, **kwargs)
-        except Exception as e:
-            # Handle the exception or log it
-            pass
-    return wrapper
-
-class DecipherMonitor(BaseHTTPMiddleware):
-    def __init__(self, app: ASGIApp, codebase_id: str, customer_id: str):
-        super().__init__(app)
-        self.codebase_id = codebase_id
-        self.customer_id = customer_id
-        self.endpoint = "https://prod.getdecipher.com/api/exception_upload"
-        #self.endpoint = "http://localhost:3000/api/exception_upload"
-        self.original_print = builtins.print
-        builtins.print = self.custom_print
+_BODY_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+class RequestState:
+    # Breadcrumbs and user of a single request, stored in the ASGI scope on first use so that
+    # sync endpoints running in the threadpool share it with the middleware
+    def __init__(self, max_breadcrumbs=100):
+        self.breadcrumbs = Breadcrumbs(max_breadcrumbs)
+        self.user = None
+
+class DecipherMonitor(DecipherClient):
+    def __init__(self, app: ASGIApp, codebase_id: str, customer_id: str, context_lines: int = 5,
+                 tee_request_body: bool = False, **options):
+        self.app = app
+        # Request bodies are only reported when opted in: keeping a copy of the body means
+        # wrapping receive on every POST/PUT/PATCH/DELETE, including the ones that succeed
+        self.tee_request_body = tee_request_body
+        super().__init__(codebase_id, customer_id, context_lines=context_lines, **options)
+        # The instance built by the app's middleware stack owns the lifespan-managed sender
+        global _decipher_monitor_instance
+        _decipher_monitor_instance = self
+
+    def create_transport(self, pool_size, connect_timeout, read_timeout, compress, batch_size,
+                         flush_interval, max_queue_size, drop_policy, json_encoder, compression):
+        if self.aggregator_socket:
+            # Writing to the local forwarder is cheap, a worker thread does it off the loop
+            return super().create_transport(pool_size, connect_timeout, read_timeout, compress,
+                                            batch_size, flush_interval, max_queue_size,
+                                            drop_policy, json_encoder, compression)
+        # Uploads run as a task on the app's event loop instead of a worker thread
+        return AsyncTransport(self.endpoint, pool_size=pool_size, connect_timeout=connect_timeout,
+                              read_timeout=read_timeout, compress=compress,
+                              batch_size=batch_size, flush_interval=flush_interval,
+                              max_queue_size=max_queue_size, spool=self.spool,
+                              json_encoder=json_encoder, compression=compression,
+                              metrics=self.metrics)
 
     async def __call__(self, scope, receive, send):
-        # Setup or any preparation before handling the request
-        request = Request(scope, receive=receive)
-        request_token = current_request.set(request)
-        messages_token = current_messages.set([])
-        user_token = current_user.set(None)
-        
+        if scope["type"] != "http":
+            if scope["type"] == "lifespan":
+                await self.handle_lifespan(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+            return
+
+        if self.tee_request_body and self.max_request_body_bytes and scope["method"] in _BODY_METHODS:
+            # Keep a bounded prefix of the body as the app consumes it
+            tee = scope["decipher.body"] = BodyTee(self.max_request_body_bytes)
+            receive = ReceiveTee(receive, tee)
+
+        start = profile = None
+        if self.latency is not None:
+            # Requests share the loop thread, this coroutine's frame tells the profiler whose
+            # task a sample belongs to
+            profile = self.start_profile(sys._getframe())
+            start = time.perf_counter()
+            send = self.track_status(scope, send)
+
+        scope_token = current_scope.set(scope)
         try:
             # Pass control to the next application in the stack
             await self.app(scope, receive, send)
         except Exception as exc:
-            # Handle the exception (e.g., logging, modifying response to client)
-            await self.capture_error_with_exception(request, exc, isManual = False)
+            # The Request is only built once there is something to report
+            await self.capture_error_with_exception(Request(scope), exc, isManual = False)
             raise exc from None
         finally:
-            current_request.reset(request_token)
-            current_messages.reset(messages_token)
-            current_user.reset(user_token)
-            builtins.print = self.original_print
+            if start is not None:
+                self.finish_request_timer(scope, time.perf_counter() - start, profile)
+            current_scope.reset(scope_token)
+
+    def track_status(self, scope, send):
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                scope["decipher.status"] = message["status"]
+            await send(message)
+        return send_wrapper
+
+    def finish_request_timer(self, scope, duration, profile=None):
+        endpoint = getattr(scope.get("route"), "endpoint", None)
+        if profile is not None and endpoint is not None and not asyncio.iscoroutinefunction(endpoint):
+            # Sync endpoints run in the threadpool, samples of the loop thread would only show
+            # the routing around them
+            self.profiler.stop(profile)
+            profile = None
+        request = Request(scope)
+        self.record_request(scope["method"], self.get_route_path(request), duration,
+                            lambda: self.prepare_slow_request_data(request), request.url.path,
+                            profile)
+
+    def prepare_slow_request_data(self, request: Request):
+        data = self.prepare_data(request)
+        # No response object here, only the status that went out (500 if none did)
+        data["status_code"] = request.scope.get("decipher.status", 500)
+        return data
+
+    async def handle_lifespan(self, scope, receive, send):
+        # Run the sender task for the lifetime of the app
+        async def lifespan_receive():
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.transport.start()
+            return message
+
+        async def lifespan_send(message):
+            if message["type"] in ("lifespan.shutdown.complete", "lifespan.shutdown.failed"):
+                if isinstance(self.transport, AsyncTransport):
+                    await self.transport.stop()
+                else:
+                    await asyncio.to_thread(self.transport.close)
+            await send(message)
+
+        await self.app(scope, lifespan_receive, lifespan_send)
+
+    def get_state(self):
+        scope = self.get_scope()
+        if scope is None:
+            return None
+        state = scope.get("decipher.state")
+        if state is None:
+            state = scope["decipher.state"] = RequestState(self.max_breadcrumbs)
+        return state
+
+    def get_breadcrumbs(self):
+        state = self.get_state()
+        return state.breadcrumbs if state is not None else super().get_breadcrumbs()
+
+    def get_scope(self):
+        # Work wrapped by wrap_executor reports against the submitting request. A process pool
+        # forked from the loop thread also inherits that request's scope, so the propagated
+        # context wins.
+        if current_context.get() is not None:
+            return None
+        return current_scope.get()
+
+    def get_context_fields(self):
+        scope = self.get_scope()
+        if scope is None:
+            return None
+        request = Request(scope)
+        return {
+            "request_url": str(request.url),
+            "request_endpoint": str(request.url.path),
+            "request_headers": dict(request.headers),
+        }
 
     def set_user(self, user):
-        if all(key in ['id', 'username', 'email'] for key in user):
-            current_user.set(user)
+        state = self.get_state()
+        if state is not None and all(key in ['id', 'username', 'email'] for key in user):
+            state.user = user
 
     async def capture_error_with_response(self, request: Request, response: Response):
         try:
-            data = await self.prepare_data(request, response=response)
-            await self.send_to_decipher(data)
+            self.send_to_decipher(self.snapshot(None, self.prepare_data(request, response=response)))
         except Exception as e:
             pass
 
+    def capture_error(self, error: Exception):
+        # Safe from any thread (the loop, sync endpoints in the threadpool, executor workers):
+        # only snapshots the error and hands it to the transport, never awaits or uploads
+        scope = self.get_scope()
+        if scope is None:
+            return self.capture_background_exception(error, False)
+        request = Request(scope)
+        return self.capture_exception(
+            error, lambda: self.prepare_data(request, exception=error, isManual=True),
+            self.get_route_path(request), request.url.path)
+
     async def capture_error_with_exception(self, request: Request, exception: Exception, isManual = True):
-        try:
-            data = await self.prepare_data(request, exception=exception, isManual = isManual)
-            await self.send_to_decipher(data)
-        except Exception as e:
-            pass
+        self.capture_exception(
+            exception, lambda: self.prepare_data(request, exception=exception, isManual=isManual),
+            self.get_route_path(request), request.url.path)
 
-    async def prepare_data(self, request: Request, response=None, exception=None, isManual = False):
-        # request_body = await request.body()
-        # try:
-        #     request_body = json.loads(request_body.decode())
-        # except json.JSONDecodeError:
-        #     request_body = request_body.decode()  # Use raw body if JSON parsing fails
+    def get_route_path(self, request: Request):
+        # Route template (e.g. /items/{item_id}) when the router has matched one
+        route = request.scope.get("route")
+        return getattr(route, "path", None)
 
+    def prepare_data(self, request: Request, response=None, exception=None, isManual = False):
         # # Initialize response data
         response_body = {}
 
@@ -94,132 +202,98 @@ class DecipherMonitor(BaseHTTPMiddleware):
 
         if response:
             status_code = response.status_code
-            try:
-                response_body = json.loads(response.body.decode())
-            except json.JSONDecodeError:
-                response_body = response.body.decode()  # Use raw body if JSON parsing fails
-
-        # Generate stack trace and local variables if an exception is provided
-        stack_trace = []
-        if exception:
-            stack_trace = self.get_stack_trace_with_code(exception)
+            response_body = self.get_response_body(response)
 
-        # Prepare the data dictionary to be sent to the Decipher server
+        # The request specific part of the event, the client adds the stack trace. Anything
+        # that is slow to build is left as a Deferred for the transport worker.
         data = {
-            "codebase_id": self.codebase_id,
-            "customer_id": self.customer_id,
-            "timestamp": self.get_timestamp(),
-            "error_stack": stack_trace,
             "request_url": str(request.url),
             "request_endpoint": str(request.url.path),
             "request_headers": dict(request.headers),
-            "request_body": None,
+            "request_body": self.get_request_body(request),
             "response_body": response_body,
             "status_code": status_code,
             "is_uncaught_exception": exception is not None,
-            'messages': current_messages.get(),
-            'affected_user': current_user.get()
+            'messages': self.get_messages(),
+            'affected_user': self.get_user()
         }
 
         return data
     
-    def get_timestamp(self):
-        return datetime.utcnow().isoformat() + 'Z'
-    
-    def add_message(message: str, level: str = "info"):
-        messages = current_messages.get()
-        messages.append({"message": message, "level": level})
-    
-    def get_stack_trace_with_code(self, exception):
-        if exception is None:
-            return []
-        
-        tb = traceback.extract_tb(exception.__traceback__)
-        formatted_trace = []
-        context = 5  # Number of lines to include around the error line
-        for frame, line_number in [(tb_frame, tb_lineno) for tb_frame, tb_lineno in traceback.walk_tb(exception.__traceback__)]:
-            filename = frame.f_code.co_filename
-            function_name = frame.f_code.co_name
-            code_context = self.get_code_context(filename, line_number, context)
-            locals = self.get_local_variables(frame)
-            formatted_trace.append({
-                "file": filename,
-                "line": line_number,
-                "function": function_name,
-                "code": code_context,
-                "highlight_index": context,
-                "start_line": max(1, line_number - context),
-                "locals": locals,
-            })
-
-        # Add the exception type and message to the last trace
-        exception_type = type(exception).__name__
-        exception_message = str(exception)
-        if formatted_trace:
-            last_trace = formatted_trace[-1]
-            last_trace.update({
-                "exception_type": exception_type,
-                "exception_message": exception_message
-            })
-        
-        return formatted_trace
-    
-    def get_code_context(self, filename, line_number, context=5):
-        start_line = max(1, line_number - context)
-        end_line = line_number + context
-        code_context = []
-        
-        for i in range(start_line, end_line + 1):
-            try:
-                line = linecache.getline(filename, i).rstrip()
-                code_context.append(line)
-            except Exception as e:
-                code_context.append("Error reading line: " + str(e))
-        
-        linecache.clearcache()
-        return code_context
-
-    def get_local_variables(self, frame):
-        return {var: repr(value) for var, value in frame.f_locals.items()}
-
-    async def send_to_decipher(self, data):
-        try:
-            await asyncio.to_thread(requests.post, self.endpoint, json=data)
-        except requests.RequestException as e:
-            pass
+    def get_request_body(self, request: Request):
+        tee = request.scope.get("decipher.body")
+        if tee is None or not (tee.buffer or tee.truncated):
+            return None
+        content_type = request.headers.get("content-type")
+        if not is_capturable(content_type):
+            return None
+        return Deferred(decode_body, tee.getvalue(), content_type, tee.truncated)
+
+    def get_response_body(self, response: Response):
+        limit = self.max_response_body_bytes
+        content_type = response.headers.get("content-type")
+        body = getattr(response, "body", None)
+        if not limit or body is None or not is_capturable(content_type):
+            return {}
+        return Deferred(decode_body, body[:limit], content_type, len(body) > limit)
 
+    def get_messages(self):
+        # Only look at state that already exists, reporting should not create it
+        scope = self.get_scope()
+        state = scope.get("decipher.state") if scope is not None else None
+        if state is None:
+            return []
+        return Deferred(state.breadcrumbs.snapshot().format, self.max_message_length)
 
-    def custom_print(self, *args, **kwargs):
-        messages = current_messages.get()
-        message = ' '.join(str(arg) for arg in args)
-        messages.append({
-            "message": message,
-            "level": "log",
-            "timestamp": self.get_timestamp()
-        })
-        self.original_print(*args, **kwargs)
+    def get_user(self):
+        scope = self.get_scope()
+        if scope is None:
+            return super().get_user()
+        state = scope.get("decipher.state")
+        return state.user if state is not None else None
 
+    def add_message(self, message: str, level: str = "info"):
+        breadcrumbs = self.get_breadcrumbs()
+        if breadcrumbs is not None:
+            breadcrumbs.add_message(message, level)
+    
     def clear_messages(self):
-        self.messages = []
+        scope = current_scope.get()
+        state = scope.get("decipher.state") if scope is not None else None
+        if state is not None:
+            state.breadcrumbs.clear()
 
 _decipher_monitor_instance = None
 
-def init(app, codebase_id, customer_id):
-    global _decipher_monitor_instance
-    _decipher_monitor_instance = DecipherMonitor(app, codebase_id, customer_id)
-    app.add_middleware(DecipherMonitor, codebase_id=codebase_id, customer_id=customer_id)
+def init(app, codebase_id, customer_id, **options):
+    # The middleware registers itself as the active instance when the app builds its stack
+    app.add_middleware(DecipherMonitor, codebase_id=codebase_id, customer_id=customer_id, **options)
 
 def capture_error(error):
-    request = current_request.get()
-    if request and _decipher_monitor_instance:
-        try:
-            if asyncio.get_event_loop().is_running():
-                # Asynchronous context: Use asyncio to handle it
-                asyncio.create_task(_decipher_monitor_instance.capture_error_with_exception(request, error, isManual = True))
-        except Exception as e:
-            asyncio.run(_decipher_monitor_instance.capture_error_with_exception(request, error, isManual = True))
+    if _decipher_monitor_instance:
+        _decipher_monitor_instance.capture_error(error)
+
+def wrap_executor(executor, capture_errors=True):
+    # Work submitted from a request carries its URL, user and breadcrumbs into the pool
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.wrap_executor(executor, capture_errors)
+    return executor
+
+def wrap_callable(func, capture_errors=True):
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.wrap_callable(func, capture_errors)
+    return func
+
+def get_sampling_stats():
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.get_sampling_stats()
+    return None
+
+def get_stats():
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.get_stats()
+    return None
 
 def set_user(user):
-    request = current_request.get()
-    if request and _decipher_monitor_instance:
+    if _decipher_monitor_instance:
         _decipher_monitor_instance.set_user(user)
\ No newline at end of file
@@ -1 +0,0 @@
-from .decipher_sdk import init, capture_error, set_user
\ No newline at end of file
@@ -7,7 +7,7 @@ setup(
     packages=find_packages(where='src'),
     install_requires=[
         'Flask',
-        'requests',
+        'decipher-core',
     ],
     author='Decipher AI, Inc',
     author_email='michael@getdecipher.com',
@@ -1 +1 @@
-from .decipher_sdk import init, capture_error, set_user
\ No newline at end of file
+from .decipher_sdk import init, capture_error, set_user, get_sampling_stats, get_stats, wrap_executor, wrap_callable
\ No newline at end of file
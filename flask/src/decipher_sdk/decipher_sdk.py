@@ -1,215 +1,200 @@
-import traceback
-import requests
-from flask import request_started, request_finished, got_request_exception
-from flask import request, has_request_context
-from datetime import datetime
+import time
+from flask import request_started, request_finished, request_tearing_down, got_request_exception
+from flask import request, has_request_context, g, after_this_request
 import json
-import builtins
-import linecache
-import functools
+from decipher_core.body import BodyTee, TeeInput, decode_body, is_capturable
+from decipher_core.breadcrumbs import Breadcrumbs
+from decipher_core.client import DecipherClient, safe_method
+from decipher_core.context import current_context
+from decipher_core.deferred import Deferred
 
-def safe_method(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            # Handle the exception or log it
-            pass
-    return wrapper
-
-class DecipherMonitor:
-    @safe_method
-    def __init__(self, codebase_id, customer_id):
-        self.codebase_id = codebase_id
-        self.customer_id = customer_id
-        self.endpoint = "https://prod.getdecipher.com/api/exception_upload"
-        #self.endpoint = "http://localhost:3000/api/exception_upload"
-        self.messages = []  # Initialize the messages list
+class RequestState:
+    # Everything that belongs to a single request, kept on flask.g instead of the shared monitor
+    def __init__(self, max_breadcrumbs=100):
+        self.breadcrumbs = Breadcrumbs(max_breadcrumbs)
         self.user = None
-        self.response = None
+        self.body_tee = None
         self.captured_exceptions = []
         self.uncaught_exception = None
+        self.flush_scheduled = False
+
+class DecipherMonitor(DecipherClient):
+    @safe_method
+    def __init__(self, codebase_id, customer_id, context_lines=40, tee_streamed_body=False,
+                 **options):
+        # Bodies read through get_data()/get_json() are cached by Flask and reported without a
+        # tee; only apps reading request.stream directly need one installed on every request
+        self.tee_streamed_body = tee_streamed_body
+        super().__init__(codebase_id, customer_id, context_lines=context_lines, **options)
         self.connect_to_signals()
 
     @safe_method
     def connect_to_signals(self):
-        # Connect to Flask signals
-        request_started.connect(self.before_request_handler)
-        request_finished.connect(self.teardown_request_handler)
+        # Only error hooks by default: a request that raises nothing never calls into the SDK
+        # (blinker returns early for signals without receivers). Manually captured errors are
+        # flushed by a per-request after_this_request callback, see append_error.
+        if self.max_request_body_bytes and self.tee_streamed_body:
+            request_started.connect(self.tee_request_body)
         got_request_exception.connect(self.capture_error_handler)
+        if self.latency is not None:
+            # Opted into latency tracking, the only case that needs every request timed. Teardown
+            # also runs when an exception propagates and request_finished is skipped.
+            request_started.connect(self.start_request_timer)
+            request_finished.connect(self.keep_response)
+            request_tearing_down.connect(self.finish_request_timer)
 
     @safe_method
-    def before_request_handler(self, sender, **extra):
-        self.exception_occurred = False
-        if has_request_context():
-            self.override_print()
+    def get_state(self):
+        if not has_request_context():
+            return None
+        state = g.get("_decipher_state")
+        if state is None:
+            state = g._decipher_state = RequestState(self.max_breadcrumbs)
+        return state
 
-    @safe_method
-    def teardown_request_handler(self, sender, response, **extra):
-        if has_request_context():
-            self.restore_print()
-            self.response = response;
-            self.handleExceptions();
+    def in_request(self):
+        # Work wrapped by wrap_executor reports against the submitting request. A process pool
+        # forked from the request thread also inherits that request's context, so the
+        # propagated context wins.
+        return has_request_context() and current_context.get() is None
 
-            #Reset state
-            self.clear_messages()
+    def get_breadcrumbs(self):
+        if not self.in_request():
+            return super().get_breadcrumbs()
+        return self.get_state().breadcrumbs
 
-    @safe_method
-    def handleExceptions(self):
-        if self.uncaught_exception:
-            self.capture_error_with_response(self.response, self.uncaught_exception, True)
-        if self.captured_exceptions:
-            for exception in self.captured_exceptions:
-                self.capture_error_with_response(self.response, exception)
-        self.response = None
-        self.user = None
-        self.uncaught_exception = None
-        self.captured_exceptions = []
+    def get_user(self):
+        if not self.in_request():
+            return super().get_user()
+        return self.get_state().user
 
     @safe_method
-    def capture_error_with_response(self, response, exception, is_uncaught_exception=False):
-        data = self.prepare_data(response, exception, is_uncaught_exception)
-        self.send_to_decipher(data)
+    def get_context_fields(self):
+        if not self.in_request():
+            return None
+        return {
+            "request_url": request.url,
+            "request_endpoint": request.endpoint,
+            "request_headers": self.get_headers(request.headers),
+        }
 
     @safe_method
-    def capture_error_handler(self, sender, exception, **extra):
-        self.uncaught_exception = exception
-        if has_request_context():
-            self.handleExceptions()
+    def tee_request_body(self, sender, **extra):
+        # Capture a bounded prefix of the body as the app reads it instead of buffering all of it
+        if not has_request_context() or not is_capturable(request.content_type):
+            return
+        if "stream" in request._get_current_object().__dict__:
+            return
+        state = self.get_state()
+        state.body_tee = BodyTee(self.max_request_body_bytes)
+        request.environ["wsgi.input"] = TeeInput(request.environ["wsgi.input"], state.body_tee)
 
     @safe_method
-    def get_request_body(self):
-        request_body = None
-        max_content_length = 10 * 1024 * 1024  # 10 MB
-        if request.content_length and request.content_length < max_content_length:
-            request_body = request.get_data(as_text=True)
-            try:
-                request_body = json.loads(request_body)
-            except json.JSONDecodeError:
-                request_body = request_body
-        return request_body
-    
-    
-    @safe_method
-    def get_local_variables(self, frame):
-        return {var: self.safe_repr(value) for var, value in frame.f_locals.items()}
-    
-    @safe_method
-    def safe_repr(self, value):
-        try:
-            return repr(value)
-        except Exception as e:
-            return f"Error in repr: {e}"
-    
-    @safe_method
-    def override_print(self):
-        self.original_print = builtins.print
-        builtins.print = self.custom_print
+    def start_request_timer(self, sender, **extra):
+        g._decipher_profile = self.start_profile()
+        g._decipher_request_start = time.perf_counter()
 
     @safe_method
-    def restore_print(self, exception=None):
-        builtins.print = self.original_print
+    def keep_response(self, sender, response, **extra):
+        g._decipher_response = response
 
     @safe_method
-    def custom_print(self, *args, **kwargs):
-        # Convert args to string and store the message
-        message = ' '.join(str(arg) for arg in args)
-        self.messages.append({
-            "message": message,
-            "level": "log",
-            "timestamp": self.get_timestamp()
-        })
-        # Call the original print function
-        self.original_print(*args, **kwargs)
+    def finish_request_timer(self, sender, **extra):
+        start = g.pop("_decipher_request_start", None)
+        if start is None:
+            return
+        # No response when an exception propagated, reported as a 500
+        response = g.get("_decipher_response")
+        rule = request.url_rule
+        self.record_request(request.method, rule.rule if rule is not None else None,
+                            time.perf_counter() - start, lambda: self.prepare_data(response),
+                            request.path, g.pop("_decipher_profile", None))
+
+    def flush_after_request(self, response):
+        # Registered with after_this_request on the first manual capture of a request
+        self.handleExceptions(response)
+        return response
 
     @safe_method
-    def capture_error_with_exception(self, sender, **extra):
-        if has_request_context():
-            data = self.prepare_data()
-            self.send_to_decipher(data)
-        #stack_trace = "\n".join(traceback.format_stack()) if response else traceback.format_exc()
+    def handleExceptions(self, response=None):
+        state = self.get_state()
+        if state is None:
+            return
+        if state.uncaught_exception:
+            self.capture_error_with_response(response, state.uncaught_exception, True)
+        if state.captured_exceptions:
+            for exception in state.captured_exceptions:
+                self.capture_error_with_response(response, exception)
+        state.uncaught_exception = None
+        state.captured_exceptions = []
 
     @safe_method
-    def get_code_context(self, filename, line_number, context=5):
-        start_line = max(1, line_number - context)
-        end_line = line_number + context
-        code_context = []
-        
-        for i in range(start_line, end_line + 1):
-            try:
-                line = linecache.getline(filename, i).rstrip()
-                code_context.append(line)
-            except Exception as e:
-                code_context.append("Error reading line: " + str(e))
-        
-        linecache.clearcache()
-        return code_context
-    
+    def capture_error_with_response(self, response, exception, is_uncaught_exception=False):
+        self.capture_exception(
+            exception, lambda: self.prepare_data(response, is_uncaught_exception),
+            request.endpoint, request.path)
+
     @safe_method
-    def get_stack_trace_with_code(self, exception):
-        if exception is None:
-            return []
-        
-        tb = traceback.extract_tb(exception.__traceback__)
-        formatted_trace = []
-        context = 40
-        for frame, line_number in [(tb_frame, tb_lineno) for tb_frame, tb_lineno in traceback.walk_tb(exception.__traceback__)]:
-            filename = frame.f_code.co_filename
-            function_name = frame.f_code.co_name
-            start_line = max(1, line_number - context)
-            code_context = self.get_code_context(filename, line_number, context)
-            locals = self.get_local_variables(frame)
-            highlight_index = line_number - start_line
-            if highlight_index >= len(code_context):
-                highlight_index = len(code_context) - 1 
-            formatted_trace.append({
-                "file": filename,
-                "line": line_number,
-                "function": function_name,
-                "code": code_context,
-                "highlight_index": highlight_index,
-                "start_line": start_line,
-                "locals": locals,  # Add local variables to the trace
-            })
-        
-        # Add the exception type and message to the last trace
-        exception_type = type(exception).__name__
-        exception_message = str(exception)
-        if formatted_trace:
-            last_trace = formatted_trace[-1]
-            last_trace.update({
-                "exception_type": exception_type,
-                "exception_message": exception_message
-            })
+    def capture_error_handler(self, sender, exception, **extra):
+        state = self.get_state()
+        if state is not None:
+            state.uncaught_exception = exception
+            self.handleExceptions()
 
-        return formatted_trace
+    @safe_method
+    def get_request_body(self):
+        limit = self.max_request_body_bytes
+        if not limit or not is_capturable(request.content_type):
+            return None
+        tee = self.get_state().body_tee
+        if tee is not None and (tee.buffer or tee.truncated):
+            data, truncated = tee.getvalue(), tee.truncated
+        else:
+            # The app never read the body (or read it before the tee was installed)
+            current = request._get_current_object()
+            cached = getattr(current, "_cached_data", None)
+            if cached is not None:
+                data = cached[:limit + 1]
+            elif request.content_length:
+                data = request.stream.read(limit + 1)
+            else:
+                return None
+            truncated = len(data) > limit
+            data = data[:limit]
+        return Deferred(decode_body, data, request.content_type, truncated)
 
+    @safe_method
+    def get_response_body(self, response):
+        limit = self.max_response_body_bytes
+        # Streamed responses are never buffered just to report them
+        if not limit or response.is_streamed or not is_capturable(response.content_type):
+            return {}
+        data = response.get_data()
+        return Deferred(decode_body, data[:limit], response.content_type, len(data) > limit)
 
     @safe_method
     def append_error(self, error):
-        self.captured_exceptions.append(error)
+        state = self.get_state()
+        if state is not None:
+            state.captured_exceptions.append(error)
+            if not state.flush_scheduled:
+                state.flush_scheduled = True
+                after_this_request(self.flush_after_request)
 
     @safe_method
-    def prepare_data(self, response, exception, is_uncaught_exception=False):
+    def prepare_data(self, response, is_uncaught_exception=False):
+        # The request specific part of the event, the client adds the stack trace. Anything
+        # that is slow to build is left as a Deferred for the transport worker.
+        state = self.get_state()
         request_body = self.get_request_body()
-        stack_trace = self.get_stack_trace_with_code(exception)
-        #stack_trace = "\n".join(traceback.format_stack()) if response else traceback.format_exc()
 
         response_body = {}
         status_code = 500
         if response:
             status_code = response.status_code
-            try:
-                response_body = json.loads(response.get_data(as_text=True))
-            except json.JSONDecodeError:
-                response_body = response.get_data(as_text=True)
+            response_body = self.get_response_body(response)
 
         data = {
-            "codebase_id": self.codebase_id,
-            "customer_id": self.customer_id,
-            "timestamp": self.get_timestamp(),
-            "error_stack": stack_trace,
             "request_url": request.url,
             "request_endpoint": request.endpoint,
             "request_headers": self.get_headers(request.headers),
@@ -217,38 +202,29 @@ class DecipherMonitor:
             "response_body": response_body,
             "status_code": status_code,
             "is_uncaught_exception": is_uncaught_exception,
-            'messages': self.messages,
-            'affected_user': self.user
+            'messages': Deferred(state.breadcrumbs.snapshot().format, self.max_message_length),
+            'affected_user': state.user
         }
         return data
 
-    @safe_method
-    def get_timestamp(self):
-        # To Do confirm this is right time format
-        return datetime.utcnow().isoformat() + 'Z'
-    
     @safe_method
     def get_headers(self, headers):
         return {header: value for header, value in headers.items()}
     
     @safe_method
     def clear_messages(self, exception=None):
-        self.messages = []
-
-    @safe_method
-    def send_to_decipher(self, data):
-        try:
-            requests.post(self.endpoint, json=data)
-        except requests.RequestException as e:
-            pass
+        state = self.get_state()
+        if state is not None:
+            state.breadcrumbs.clear()
 
     @safe_method
     def capture_error(self, error):
-        if has_request_context():
-            self.capture_error_with_exception(request._get_current_object(), error)
+        if self.in_request():
+            # Reported with the response once the request is done, see append_error
+            self.append_error(error)
         else:
-            # Handle cases where there is no Flask request context
-            pass
+            # Background threads, executor workers, CLI commands
+            self.capture_background_exception(error, False)
 
     @safe_method
     def safe_stringify(self, obj, indent=2):
@@ -258,22 +234,44 @@ class DecipherMonitor:
             return str(obj)
 
     def set_user(self, user):
-        if all(key in ['id', 'username', 'email'] for key in user):
-            self.user = user
+        state = self.get_state()
+        if state is not None and all(key in ['id', 'username', 'email'] for key in user):
+            state.user = user
         
 _decipher_monitor_instance = None
 
-def init(codebase_id, customer_id):
+def init(codebase_id, customer_id, **options):
     global _decipher_monitor_instance
-    _decipher_monitor_instance = DecipherMonitor(codebase_id, customer_id)
+    _decipher_monitor_instance = DecipherMonitor(codebase_id, customer_id, **options)
 
 def capture_error(error):
     if _decipher_monitor_instance:
-        _decipher_monitor_instance.append_error(error)
+        _decipher_monitor_instance.capture_error(error)
     else:
         # Handle the case where DecipherMonitor is not initialized
         pass
 
+def wrap_executor(executor, capture_errors=True):
+    # Work submitted from a request carries its URL, user and breadcrumbs into the pool
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.wrap_executor(executor, capture_errors)
+    return executor
+
+def wrap_callable(func, capture_errors=True):
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.wrap_callable(func, capture_errors)
+    return func
+
+def get_sampling_stats():
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.get_sampling_stats()
+    return None
+
+def get_stats():
+    if _decipher_monitor_instance:
+        return _decipher_monitor_instance.get_stats()
+    return None
+
 def set_user(user):
     if _decipher_monitor_instance:
         _decipher_monitor_instance.set_user(user)